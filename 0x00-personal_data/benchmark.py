@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for log redaction and password hashing.
+
+Usage:
+    ./benchmark.py [--quick] [-o results.json] [--baseline baseline.json]
+                   [--save-baseline baseline.json] [--threshold 0.1]
+
+Each case reports ops/sec, p50/p99 latency and bytes allocated per
+operation as JSON. Against a baseline, cases whose ops/sec dropped by more
+than the threshold are reported and the exit status is 1.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from encrypt_password import hash_password, is_valid
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+SEPARATORS: Tuple[str, ...] = (";", ",", "&")
+MESSAGE_SIZES: Tuple[int, ...] = (64, 1024, 16384)
+FIELD_COUNTS: Tuple[int, ...] = (1, 5, 20)
+BCRYPT_ROUNDS: Tuple[int, ...] = (4, 8, 12)
+
+
+def make_message(size: int, fields: List[str], separator: str) -> str:
+    """
+    Builds a "key=value<separator>" log line of about size characters,
+    cycling through the given fields and a non-PII field.
+
+    Args:
+        size: The target length of the message.
+        fields: The field names used in the message.
+        separator: The field separator.
+
+    Returns:
+        The log line.
+    """
+    keys = list(fields) + ["ip"]
+    parts = []
+    length = 0
+    i = 0
+    while length < size:
+        part = "{}=value{}{}".format(keys[i % len(keys)], i, separator)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Returns count field names, starting with PII_FIELDS.
+
+    Args:
+        count: The number of fields.
+
+    Returns:
+        The field names.
+    """
+    fields = list(PII_FIELDS[:count])
+    fields += ["field{}".format(i) for i in range(count - len(fields))]
+    return fields
+
+
+def measure(op: Callable[[], object], min_time: float,
+            max_ops: int) -> Dict[str, float]:
+    """
+    Times an operation and measures its memory allocations.
+
+    The operation runs until min_time seconds have elapsed or max_ops
+    operations were done, then a few more times under tracemalloc.
+
+    Args:
+        op: The operation to measure.
+        min_time: The minimum measuring time, in seconds.
+        max_ops: The maximum number of timed operations.
+
+    Returns:
+        A dictionary with ops, ops_per_sec, p50_us, p99_us and
+        bytes_allocated.
+    """
+    op()
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < max_ops:
+        t0 = time.perf_counter_ns()
+        op()
+        timings.append(time.perf_counter_ns() - t0)
+        if time.perf_counter() - start >= min_time:
+            break
+    timings.sort()
+
+    samples = min(len(timings), 20)
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                # reset_peak is new in Python 3.9, a restart clears it too
+                tracemalloc.stop()
+                tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            op()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops": len(timings),
+        "ops_per_sec": round(len(timings) * 1e9 / sum(timings), 2),
+        "p50_us": round(timings[len(timings) // 2] / 1e3, 3),
+        "p99_us": round(timings[int(len(timings) * 0.99)] / 1e3, 3),
+        "bytes_allocated": allocated // samples,
+    }
+
+
+def cases(quick: bool) -> Iterator[Tuple[str, Callable[[], object]]]:
+    """
+    Yields the (name, operation) benchmark cases.
+
+    Args:
+        quick: Whether to only run the smallest variants.
+
+    Yields:
+        The name and the operation of each case.
+    """
+    sizes = MESSAGE_SIZES[:2] if quick else MESSAGE_SIZES
+    counts = FIELD_COUNTS[:2] if quick else FIELD_COUNTS
+    separators = SEPARATORS[:1] if quick else SEPARATORS
+    rounds_list = BCRYPT_ROUNDS[:1] if quick else BCRYPT_ROUNDS
+
+    for size in sizes:
+        for count in counts:
+            fields = make_fields(count)
+            for separator in separators:
+                message = make_message(size, fields, separator)
+                yield ("filter_datum[size={},fields={},sep={}]".format(
+                    size, count, separator),
+                    lambda f=fields, m=message, s=separator:
+                        filter_datum(f, "***", m, s))
+
+    for size in sizes:
+        formatter = RedactingFormatter(fields=PII_FIELDS)
+        record = logging.LogRecord(
+            "user_data", logging.INFO, __file__, 0,
+            make_message(size, list(PII_FIELDS), ";"), None, None)
+        yield ("RedactingFormatter.format[size={}]".format(size),
+               lambda f=formatter, r=record: f.format(r))
+
+    for rounds in rounds_list:
+        hashed = hash_password("benchmark password", rounds)
+        yield ("hash_password[rounds={}]".format(rounds),
+               lambda r=rounds: hash_password("benchmark password", r))
+        yield ("is_valid[rounds={}]".format(rounds),
+               lambda h=hashed: is_valid(h, "benchmark password"))
+
+
+def compare(results: Dict[str, Dict[str, float]],
+            baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """
+    Returns the cases whose throughput regressed against a baseline.
+
+    Args:
+        results: The current results, by case name.
+        baseline: The baseline results, by case name.
+        threshold: The tolerated relative drop of ops/sec.
+
+    Returns:
+        One message per regressed case.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or not reference.get("ops_per_sec"):
+            continue
+        change = result["ops_per_sec"] / reference["ops_per_sec"] - 1
+        result["change"] = round(change, 4)
+        if change < -threshold:
+            regressions.append("{}: {:.2f} ops/sec vs {:.2f} ({:+.1%})".format(
+                name, result["ops_per_sec"], reference["ops_per_sec"],
+                change))
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    """
+    Runs the benchmarks and reports the results.
+
+    Args:
+        argv: The command line arguments, without the program name.
+
+    Returns:
+        The exit status: 1 if a regression was found, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--quick", action="store_true",
+                        help="only run the smallest variants")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="minimum time per case, in seconds")
+    parser.add_argument("--max-ops", type=int, default=100000,
+                        help="maximum operations per case")
+    parser.add_argument("-o", "--output",
+                        help="results file (standard output by default)")
+    parser.add_argument("--baseline", help="baseline results to compare to")
+    parser.add_argument("--save-baseline",
+                        help="also write the results as a new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="tolerated ops/sec drop (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, op in cases(args.quick):
+        results[name] = measure(op, args.min_time, args.max_ops)
+        print("{:<50} {:>14.2f} ops/sec".format(
+            name, results[name]["ops_per_sec"]), file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+
+    document = json.dumps({"python": sys.version.split()[0],
+                           "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(document + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
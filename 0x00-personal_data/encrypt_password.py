@@ -4,20 +4,24 @@ Module for password encryption and validation.
 """
 
 import bcrypt
-from typing import Union
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List, Tuple, Union
 
 
-def hash_password(password: str) -> bytes:
+def hash_password(password: str, rounds: int = 12) -> bytes:
     """
     Hashes a password using bcrypt.
 
     Args:
         password: The password to hash.
+        rounds: The bcrypt cost factor.
 
     Returns:
         The hashed password as a byte string.
     """
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds))
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
@@ -32,3 +36,122 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         True if the password is valid, False otherwise.
     """
     return bcrypt.checkpw(password.encode(), hashed_password)
+
+
+_executor: ThreadPoolExecutor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool shared by the batch functions, created on
+    first use with one thread per CPU. bcrypt releases the GIL, so the
+    threads hash in parallel.
+
+    Returns:
+        A ThreadPoolExecutor object.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                thread_name_prefix="encrypt_password")
+        return _executor
+
+
+def hash_password_async(password: str) -> Future:
+    """
+    Hashes a password on the shared thread pool.
+
+    Args:
+        password: The password to hash.
+
+    Returns:
+        A future resolving to the hashed password.
+    """
+    return get_executor().submit(hash_password, password)
+
+
+def is_valid_async(hashed_password: bytes, password: str) -> Future:
+    """
+    Validates a password on the shared thread pool.
+
+    Args:
+        hashed_password: The hashed password.
+        password: The password to validate.
+
+    Returns:
+        A future resolving to True if the password is valid.
+    """
+    return get_executor().submit(is_valid, hashed_password, password)
+
+
+def hash_many_async(passwords: Iterable[str]) -> List[Future]:
+    """
+    Hashes many passwords on the shared thread pool.
+
+    Args:
+        passwords: The passwords to hash.
+
+    Returns:
+        One future per password, in input order.
+    """
+    return [hash_password_async(password) for password in passwords]
+
+
+def verify_many_async(
+        pairs: Iterable[Tuple[bytes, str]]) -> List[Future]:
+    """
+    Validates many passwords on the shared thread pool.
+
+    Args:
+        pairs: (hashed_password, password) tuples.
+
+    Returns:
+        One future per pair, in input order.
+    """
+    return [is_valid_async(hashed, password) for hashed, password in pairs]
+
+
+def _results(futures: List[Future]) -> List[Union[bytes, bool, Exception]]:
+    """
+    Waits for futures and collects their results in order, an exception
+    standing in for the result of an item that failed.
+    """
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def hash_many(passwords: Iterable[str]) -> List[Union[bytes, Exception]]:
+    """
+    Hashes many passwords in parallel.
+
+    Args:
+        passwords: The passwords to hash.
+
+    Returns:
+        The hashed passwords in input order; an item that could not be
+        hashed is replaced by the exception raised.
+    """
+    return _results(hash_many_async(passwords))
+
+
+def verify_many(
+        pairs: Iterable[Tuple[bytes, str]]) -> List[Union[bool, Exception]]:
+    """
+    Validates many passwords in parallel.
+
+    Args:
+        pairs: (hashed_password, password) tuples.
+
+    Returns:
+        True or False for each pair in input order; a pair that could not
+        be checked is replaced by the exception raised.
+    """
+    return _results(verify_many_async(pairs))
@@ -4,9 +4,27 @@ Module for filtering log data.
 """
 
 import re
-from typing import List, Tuple
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import (BinaryIO, Callable, Dict, Iterable, Iterator, List,
+                    TextIO, Tuple)
+import argparse
+import atexit
+import csv
+import io
+import json
 import logging
+import logging.handlers
+import mmap
+import multiprocessing
+import multiprocessing.pool
 import os
+import queue
+import sys
+import threading
+import time
 import mysql.connector
 from mysql.connector import connection
 
@@ -26,10 +44,53 @@ def filter_datum(fields: List[str],
     Returns:
         The obfuscated log message.
     """
-    for field in fields:
-        message = re.sub(f'{field}=.*?{separator}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    return get_redactor(tuple(fields), redaction, separator)(message)
+
+
+@lru_cache(maxsize=128)
+def get_redactor(fields: Tuple[str, ...],
+                 redaction: str, separator: str) -> Callable[[str], str]:
+    """
+    Returns a function redacting all fields of a log line in a single pass.
+
+    The fields are joined into one alternation pattern, compiled once and
+    cached by (fields, separator, redaction). Each alternative is the
+    pattern field=.*?separator of the former per-field substitution, so
+    fields and separator keep their regular expression meaning. Unlike
+    those passes, the text put by a redaction is not scanned again for
+    the next fields, which only matters if the separator can match it.
+
+    Args:
+        fields: A tuple of strings representing all fields to obfuscate.
+        redaction: A string representing by what the field will be obfuscated.
+        separator: A string representing by which character is separating all
+        fields in the log line.
+
+    Returns:
+        A function taking a log line and returning it obfuscated.
+    """
+    if not fields:
+        return str
+    pattern = re.compile('|'.join(
+        '(?P<f{}>{}=.*?{})'.format(i, field, separator)
+        for i, field in enumerate(fields)))
+    replacements = {
+        'f{}'.format(i): '{}={}{}'.format(field, redaction, separator)
+        for i, field in enumerate(fields)}
+
+    def replace(match: re.Match) -> str:
+        """ Returns the redacted form of the matched field """
+        return replacements[match.lastgroup]
+
+    def redact(message: str) -> str:
+        """ Returns the log line obfuscated """
+        return pattern.sub(replace, message)
+
+    return redact
+
+
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    "message", "asctime", "taskName"}
 
 
 class RedactingFormatter(logging.Formatter):
@@ -39,15 +100,69 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
+    def __init__(self, fields: List[str], structured: bool = False):
         """
         Initialize the formatter with a list of fields to redact.
 
+        In structured mode, fields passed as a dict of arguments
+        (logger.info("%(email)s", {"email": ...})) or as extra attributes
+        (logger.info(..., extra={"email": ...})) are redacted by key before
+        formatting. The message is still scanned, for fields written in
+        the format string or in the values of other keys.
+
         Args:
             fields: A list of strings representing the fields to redact.
+            structured: Whether to redact dict arguments and extra
+            attributes by key.
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.structured = structured
+        self._field_set = frozenset(fields)
+        self._redact = get_redactor(
+            tuple(fields), self.REDACTION, self.SEPARATOR)
+
+    def redact_record(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Returns a copy of the record with the fields redacted in its dict
+        arguments and extra attributes. The record itself is left as is
+        for the other handlers.
+
+        Args:
+            record: The log record to redact.
+
+        Returns:
+            The redacted log record.
+        """
+        redacted = {key: self.REDACTION for key in self._field_set
+                    if key in record.__dict__
+                    and key not in _RECORD_ATTRIBUTES}
+        args = record.args
+        if isinstance(args, Mapping) and not self._field_set.isdisjoint(args):
+            args = {key: self.REDACTION if key in self._field_set else value
+                    for key, value in args.items()}
+        elif not redacted:
+            return record
+        copy = logging.makeLogRecord(record.__dict__)
+        copy.__dict__.update(redacted)
+        copy.args = args
+        return copy
+
+    def extra_fields(self, record: logging.LogRecord) -> Dict[str, object]:
+        """
+        Returns the dict arguments and extra attributes of a record.
+
+        Args:
+            record: The log record.
+
+        Returns:
+            A dictionary of the structured fields of the record.
+        """
+        fields = {key: value for key, value in record.__dict__.items()
+                  if key not in _RECORD_ATTRIBUTES}
+        if isinstance(record.args, Mapping):
+            fields.update(record.args)
+        return fields
 
     def format(self, record: logging.LogRecord) -> str:
         """
@@ -59,34 +174,228 @@ class RedactingFormatter(logging.Formatter):
         Returns:
             The formatted and redacted log record.
         """
+        if self.structured:
+            record = self.redact_record(record)
         message = super(RedactingFormatter, self).format(record)
-        return filter_datum(
-            self.fields, self.REDACTION, message, self.SEPARATOR)
+        return self._redact(message)
+
+
+class JSONRedactingFormatter(RedactingFormatter):
+    """ Redacting formatter writing one JSON object per record
+
+    Each line holds the time, logger, level and redacted message of the
+    record, along with its dict arguments and extra attributes, redacted
+    by key and their string values scanned, under "fields".
+    """
+
+    def __init__(self, fields: List[str]):
+        """
+        Initialize the formatter with a list of fields to redact.
+
+        Args:
+            fields: A list of strings representing the fields to redact.
+        """
+        super(JSONRedactingFormatter, self).__init__(fields, structured=True)
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format the log record as a redacted JSON line.
+
+        Args:
+            record: The log record to format.
+
+        Returns:
+            The JSON document of the record.
+        """
+        record = self.redact_record(record)
+        message = self._redact(record.getMessage())
+        document = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": message,
+        }
+        fields = {key: self._redact(value) if isinstance(value, str)
+                  else value
+                  for key, value in self.extra_fields(record).items()}
+        if fields:
+            document["fields"] = fields
+        if record.exc_info:
+            document["exc_info"] = self._redact(
+                self.formatException(record.exc_info))
+        return json.dumps(document, default=str)
 
 
 PII_FIELDS: Tuple[str, ...] = ("name", "email", "phone", "ssn", "password")
 
 
-def get_logger() -> logging.Logger:
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler for a bounded queue
+
+    When the queue is full, records are either dropped and counted
+    (overflow="drop") or the caller waits for room (overflow="block").
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = "drop"):
+        """
+        Initialize the handler.
+
+        Args:
+            log_queue: The queue records are put on.
+            overflow: Either "drop" or "block".
+        """
+        if overflow not in ("drop", "block"):
+            raise ValueError("overflow must be 'drop' or 'block'")
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        """
+        Put a record on the queue according to the overflow policy.
+
+        Args:
+            record: The log record to enqueue.
+        """
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Prepare a record for the queue. Records with dict arguments are
+        queued unformatted so the listener can still redact them by key.
+
+        Args:
+            record: The log record to prepare.
+
+        Returns:
+            The record to enqueue.
+        """
+        if isinstance(record.args, Mapping):
+            return logging.makeLogRecord(record.__dict__)
+        return super(DroppingQueueHandler, self).prepare(record)
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """ Queue listener flushing its handlers once per drained batch
+    instead of once per record """
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        """
+        Return the next record, flushing the handlers whenever the queue
+        has been drained.
+
+        Args:
+            block: Whether to wait for a record.
+
+        Returns:
+            The next log record.
+        """
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush()
+            return self.queue.get(block)
+
+    def enqueue_sentinel(self):
+        """
+        Wait for room on the queue to put the stop sentinel, so a full
+        bounded queue is still drained on shutdown.
+        """
+        self.queue.put(self._sentinel)
+
+
+class BufferedStreamHandler(logging.StreamHandler):
+    """ Stream handler leaving flushing to the caller """
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Write a formatted record to the stream without flushing it.
+
+        Args:
+            record: The log record to write.
+        """
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+_listener: BatchingQueueListener = None
+
+
+def get_logger(async_mode: bool = False, queue_size: int = 10000,
+               overflow: str = "drop",
+               structured: bool = False) -> logging.Logger:
     """
     Creates and returns a logger named "user_data".
 
+    The logger is configured once: later calls return it unchanged
+    instead of stacking new handlers.
+
+    In async mode the caller only enqueues records on a bounded queue; a
+    background listener thread redacts and writes them in batches.
+
+    Args:
+        async_mode: Whether redaction and writes happen off the caller's
+        thread.
+        queue_size: The maximum number of pending records in async mode.
+        overflow: What to do when the queue is full: "drop" or "block".
+        structured: Whether the formatter redacts dict arguments and extra
+        attributes by key (see RedactingFormatter).
+
     Returns:
         A logging.Logger object.
     """
+    global _listener
     logger = logging.getLogger("user_data")
+    if logger.handlers:
+        return logger
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
-    stream_handler = logging.StreamHandler()
-    formatter = RedactingFormatter(fields=PII_FIELDS)
-    stream_handler.setFormatter(formatter)
+    formatter = RedactingFormatter(fields=PII_FIELDS, structured=structured)
+    if not async_mode:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        logger.addHandler(stream_handler)
+        return logger
 
-    logger.addHandler(stream_handler)
+    log_queue = queue.Queue(maxsize=queue_size)
+    stream_handler = BufferedStreamHandler()
+    stream_handler.setFormatter(formatter)
+    _listener = BatchingQueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.unregister(shutdown_logger)
+    atexit.register(shutdown_logger)
+    logger.addHandler(DroppingQueueHandler(log_queue, overflow))
 
     return logger
 
 
+def shutdown_logger():
+    """
+    Flush pending records and remove the handlers of the "user_data"
+    logger, stopping the background listener in async mode.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.flush()
+        _listener = None
+    logger = logging.getLogger("user_data")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
 def get_db() -> connection.MySQLConnection:
     """
     Connect to a secure database and return the connection object.
@@ -107,24 +416,610 @@ def get_db() -> connection.MySQLConnection:
     )
 
 
-def main():
+def _env_int(name: str, default: int) -> int:
     """
-    Retrieves and prints all rows in the users table with fields filtered.
+    Returns a strictly positive integer read from an environment variable.
+
+    Args:
+        name: The environment variable name.
+        default: The value used when the variable is unset or invalid.
+
+    Returns:
+        The integer value.
     """
-    db = get_db()
-    cursor = db.cursor()
+    try:
+        value = int(os.getenv(name, default))
+    except ValueError:
+        return default
+    return value if value > 0 else default
 
-    cursor.execute("SELECT * FROM users;")
-    rows = cursor.fetchall()
 
-    logger = get_logger()
+class ConnectionPool:
+    """ Thread-safe pool of database connections
+
+    At most `size` connections are open at once; borrowers wait when they
+    are all in use. Connections older than `recycle` seconds, or found
+    disconnected, are closed and replaced when borrowed.
+    """
+
+    def __init__(self, connect: Callable[[], connection.MySQLConnection],
+                 size: int = 5, recycle: int = 3600):
+        """
+        Initialize an empty pool.
+
+        Args:
+            connect: A function opening a new connection.
+            size: The maximum number of open connections.
+            recycle: The maximum age of a connection, in seconds.
+        """
+        self._connect = connect
+        self.size = size
+        self.recycle = recycle
+        self._idle: List[Tuple[connection.MySQLConnection, float]] = []
+        self._born: Dict[int, float] = {}
+        self._open = 0
+        self._lock = threading.Condition()
+        self._stats = {"created": 0, "reused": 0, "recycled": 0, "waits": 0}
+
+    def _is_stale(self, db: connection.MySQLConnection,
+                  born: float) -> bool:
+        """ Returns True if an idle connection must be replaced
+
+        It may ask the server, so it is called without holding the lock.
+        """
+        if time.monotonic() - born > self.recycle:
+            return True
+        is_connected = getattr(db, "is_connected", None)
+        return is_connected is not None and not is_connected()
+
+    def acquire(self, timeout: float = None) -> connection.MySQLConnection:
+        """
+        Borrow a connection, opening one if the pool is not full.
+
+        Args:
+            timeout: The maximum time to wait for a free connection.
+
+        Returns:
+            An open connection, to be given back with release().
+
+        Raises:
+            TimeoutError: If no connection was freed in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        db = None
+        with self._lock:
+            while not self._idle and self._open >= self.size:
+                self._stats["waits"] += 1
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or \
+                        not self._lock.wait(remaining):
+                    raise TimeoutError("no database connection available")
+            if self._idle:
+                db, born = self._idle.pop()
+            else:
+                self._open += 1
+        if db is not None:
+            # The connection keeps its slot while it is checked
+            if not self._is_stale(db, born):
+                with self._lock:
+                    self._stats["reused"] += 1
+                return db
+            with self._lock:
+                self._stats["recycled"] += 1
+                del self._born[id(db)]
+            self._close(db)
+        try:
+            db = self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._born[id(db)] = time.monotonic()
+            self._stats["created"] += 1
+        return db
+
+    def release(self, db: connection.MySQLConnection):
+        """
+        Give a borrowed connection back to the pool.
+
+        Args:
+            db: A connection returned by acquire().
+        """
+        with self._lock:
+            born = self._born.get(id(db))
+            if born is not None:
+                self._idle.append((db, born))
+                self._lock.notify()
+        if born is None:
+            self._close(db)
+
+    @contextmanager
+    def borrow(self,
+               timeout: float = None) -> Iterator[connection.MySQLConnection]:
+        """
+        Borrow a connection for the duration of a with block.
+
+        Args:
+            timeout: The maximum time to wait for a free connection.
+
+        Yields:
+            An open connection.
+        """
+        db = self.acquire(timeout)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the pool counters and its current occupancy.
+
+        Returns:
+            A dictionary with the created, reused, recycled and waits
+            counters and the size, open, idle and in_use gauges.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = stats["open"] - stats["idle"]
+        return stats
+
+    def close(self):
+        """
+        Close the idle connections. Connections still borrowed go back to
+        the pool as usual when released.
+        """
+        with self._lock:
+            idle = self._idle
+            for db, _ in idle:
+                del self._born[id(db)]
+            self._open -= len(idle)
+            self._idle = []
+            self._lock.notify_all()
+        for db, _ in idle:
+            self._close(db)
+
+    @staticmethod
+    def _close(db: connection.MySQLConnection):
+        """ Close a connection, ignoring errors """
+        try:
+            db.close()
+        except Exception:
+            pass
+
+
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the process-wide connection pool, created on first use.
+
+    Connections are opened with get_db, so they use the
+    PERSONAL_DATA_DB_* environment variables. The pool is sized with
+    PERSONAL_DATA_DB_POOL_SIZE (5 by default) and connections are
+    recycled after PERSONAL_DATA_DB_POOL_RECYCLE seconds (3600 by
+    default).
+
+    Returns:
+        A ConnectionPool object.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                get_db,
+                size=_env_int('PERSONAL_DATA_DB_POOL_SIZE', 5),
+                recycle=_env_int('PERSONAL_DATA_DB_POOL_RECYCLE', 3600))
+        return _pool
+
+
+USER_ROW_FORMAT = ("name={}; email={}; phone={}; ssn={}; password={}; "
+                   "ip={}; last_login={}; user_agent={};")
+
+
+def get_batch_size() -> int:
+    """
+    Returns the number of rows fetched per batch, read from the
+    PERSONAL_DATA_BATCH_SIZE environment variable (1000 by default).
+
+    Returns:
+        A strictly positive batch size.
+    """
+    return _env_int('PERSONAL_DATA_BATCH_SIZE', 1000)
+
+
+def stream_batches(db: connection.MySQLConnection, query: str,
+                   batch_size: int = None
+                   ) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """
+    Yields the rows of a query by batches, without loading the whole
+    result set.
+
+    An unbuffered cursor is used and rows are read with fetchmany, so at
+    most batch_size rows are held in memory at once.
+
+    Args:
+        db: An open database connection.
+        query: The SELECT statement to run.
+        batch_size: The number of rows fetched per round trip.
+
+    Yields:
+        The column names of the result set and the next batch of rows.
+    """
+    if batch_size is None:
+        batch_size = get_batch_size()
+    cursor = db.cursor(buffered=False)
+    try:
+        cursor.execute(query)
+        columns = [column[0] for column in cursor.description]
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            yield columns, rows
+            rows = cursor.fetchmany(batch_size)
+    finally:
+        # Drain what the caller left unread so the connection stays usable
+        try:
+            while cursor.fetchmany(batch_size):
+                pass
+        except Exception:
+            pass
+        cursor.close()
+
+
+def stream_rows(db: connection.MySQLConnection, query: str,
+                batch_size: int = None) -> Iterator[tuple]:
+    """
+    Yields the rows of a query without loading the whole result set.
+
+    Args:
+        db: An open database connection.
+        query: The SELECT statement to run.
+        batch_size: The number of rows fetched per round trip.
+
+    Yields:
+        Each row of the result set as a tuple.
+    """
+    for _, rows in stream_batches(db, query, batch_size):
+        yield from rows
+
+
+def user_lines(db: connection.MySQLConnection,
+               batch_size: int = None) -> Iterator[str]:
+    """
+    Yields one log line per row of the users table, not redacted.
+
+    Args:
+        db: An open database connection.
+        batch_size: The number of rows fetched per round trip.
+
+    Yields:
+        The "key=value;" log line of each user.
+    """
+    for row in stream_rows(db, "SELECT * FROM users;", batch_size):
+        yield USER_ROW_FORMAT.format(*row)
+
+
+def redacted_user_lines(db: connection.MySQLConnection,
+                        batch_size: int = None,
+                        fields: Tuple[str, ...] = PII_FIELDS) -> Iterator[str]:
+    """
+    Yields one redacted log line per row of the users table.
+
+    Args:
+        db: An open database connection.
+        batch_size: The number of rows fetched per round trip.
+        fields: The fields to obfuscate.
+
+    Yields:
+        The "key=value;" log line of each user with fields obfuscated.
+    """
+    redact = get_redactor(tuple(fields), RedactingFormatter.REDACTION,
+                          RedactingFormatter.SEPARATOR)
+    for line in user_lines(db, batch_size):
+        yield redact(line)
+
+
+def _imap_bounded(pool: multiprocessing.pool.Pool, func: Callable,
+                  tasks: Iterable, window: int) -> Iterator:
+    """
+    Like pool.imap, but only pulls a new task from tasks once fewer than
+    window results are pending, so a large or lazy input is never read
+    ahead.
+
+    Args:
+        pool: The process pool.
+        func: The function applied to each task.
+        tasks: The tasks, passed to func as its only argument.
+        window: The maximum number of pending results.
+
+    Yields:
+        The results, in task order.
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def _chunk_bounds(data: mmap.mmap,
+                  chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """
+    Yields (start, end) offsets splitting data into chunks of about
+    chunk_size bytes, each ending on a line boundary.
+
+    Args:
+        data: The memory-mapped file.
+        chunk_size: The target chunk size in bytes.
+
+    Yields:
+        The start and end offsets of each chunk.
+    """
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b"\n", min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def _redact_chunk(task: Tuple[str, int, int, Tuple[str, ...], str, str]
+                  ) -> bytes:
+    """
+    Redacts one chunk of a log file, in a worker process.
+
+    Args:
+        task: The file path, chunk start and end offsets, fields,
+        redaction and separator.
+
+    Returns:
+        The redacted chunk.
+    """
+    file_path, start, end, fields, redaction, separator = task
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunk = data[start:end].decode("utf-8", "surrogateescape")
+    redact = get_redactor(fields, redaction, separator)
+    return redact(chunk).encode("utf-8", "surrogateescape")
+
+
+def redact_file(src: str, dst: BinaryIO,
+                fields: Tuple[str, ...] = PII_FIELDS,
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                workers: int = None, chunk_size: int = 8 << 20) -> int:
+    """
+    Redacts a log file with the filter_datum semantics, in parallel.
+
+    The file is memory-mapped and split on line boundaries; chunks are
+    redacted in a process pool and written in order. At most two chunks
+    per worker are in flight, so memory does not depend on the file size.
+
+    Args:
+        src: The path of the log file to redact.
+        dst: The binary stream the redacted log is written to.
+        fields: The fields to obfuscate.
+        redaction: What the fields are obfuscated with.
+        separator: The character separating the fields.
+        workers: The number of processes (one per CPU by default).
+        chunk_size: The target chunk size in bytes.
+
+    Returns:
+        The number of bytes read.
+    """
+    fields = tuple(fields)
+    workers = workers or os.cpu_count() or 1
+    if os.path.getsize(src) == 0:
+        return 0
+    with open(src, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            bounds = list(_chunk_bounds(data, chunk_size))
+            size = len(data)
+    tasks = ((src, start, end, fields, redaction, separator)
+             for start, end in bounds)
+    with multiprocessing.Pool(workers) as pool:
+        for chunk in _imap_bounded(pool, _redact_chunk, tasks, 2 * workers):
+            dst.write(chunk)
+    dst.flush()
+    return size
+
+
+EXPORT_FORMATS: Tuple[str, ...] = ("ndjson", "csv")
+
+
+def _export_batch(task: Tuple[List[str], List[tuple], Tuple[str, ...],
+                              str, str]) -> str:
+    """
+    Redacts a batch of rows by column name and serializes it.
+
+    Args:
+        task: The column names, rows, fields, redaction and export format.
+
+    Returns:
+        The NDJSON lines or CSV rows of the batch.
+    """
+    columns, rows, fields, redaction, fmt = task
+    redacted = [i for i, column in enumerate(columns) if column in fields]
+    out = io.StringIO()
+    writer = csv.writer(out) if fmt == "csv" else None
     for row in rows:
-        message = "name={}; email={}; phone={}; ssn={}; password={}; ip={}; last_login={}; user_agent={};".format(*row)
-        logger.info(message)
+        row = list(row)
+        for i in redacted:
+            row[i] = redaction
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(dict(zip(columns, row)), default=str))
+            out.write("\n")
+    return out.getvalue()
+
 
-    cursor.close()
-    db.close()
+def export_users(db: connection.MySQLConnection, dst: TextIO,
+                 fmt: str = "ndjson", fields: Tuple[str, ...] = PII_FIELDS,
+                 redaction: str = RedactingFormatter.REDACTION,
+                 batch_size: int = None, workers: int = 0) -> int:
+    """
+    Streams the users table to dst as redacted NDJSON or CSV.
+
+    Columns are redacted by name, straight from the rows, as they are
+    fetched batch by batch. With workers, batches are redacted and
+    serialized in a process pool and written in order.
+
+    Args:
+        db: An open database connection.
+        dst: The text stream the export is written to.
+        fmt: The export format, "ndjson" or "csv" (with a header line).
+        fields: The columns to obfuscate.
+        redaction: What the columns are obfuscated with.
+        batch_size: The number of rows fetched per round trip.
+        workers: The number of processes, 0 to work in this process.
+
+    Returns:
+        The number of rows exported.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("fmt must be one of {}".format(EXPORT_FORMATS))
+    fields = tuple(fields)
+    count = 0
+    header = fmt == "csv"
+
+    def tasks() -> Iterator[tuple]:
+        """ Yields the export tasks, writing the CSV header first """
+        nonlocal count, header
+        for columns, rows in stream_batches(db, "SELECT * FROM users;",
+                                            batch_size):
+            if header:
+                csv.writer(dst).writerow(columns)
+                header = False
+            count += len(rows)
+            yield columns, rows, fields, redaction, fmt
+
+    if workers:
+        with multiprocessing.Pool(workers) as pool:
+            for chunk in _imap_bounded(pool, _export_batch, tasks(),
+                                       2 * workers):
+                dst.write(chunk)
+    else:
+        for task in tasks():
+            dst.write(_export_batch(task))
+    dst.flush()
+    return count
+
+
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+def cli(argv: List[str]) -> int:
+    """
+    Entry point of the command line tools:
+
+        ./filtered_logger.py redact [-o OUTPUT] [-f FIELD ...] FILE
+        ./filtered_logger.py export [-o OUTPUT] [--format ndjson|csv]
+
+    "redact" scrubs existing log files, "export" writes a redacted extract
+    of the users table.
+
+    Args:
+        argv: The command line arguments, without the program name.
+
+    Returns:
+        The exit status.
+    """
+    parser = argparse.ArgumentParser(prog="filtered_logger.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    redact = commands.add_parser(
+        "redact", help="redact PII fields in existing log files")
+    redact.add_argument("file", help="log file to redact")
+    redact.add_argument("-s", "--separator",
+                        default=RedactingFormatter.SEPARATOR,
+                        help="field separator, taken literally (no "
+                             "regular expression metacharacters)")
+    redact.add_argument("-j", "--workers", type=int,
+                        help="number of processes (one per CPU by default)")
+    redact.add_argument("--chunk-size", type=int, default=8,
+                        help="chunk size in MiB (default: 8)")
+
+    export = commands.add_parser(
+        "export", help="export the users table as redacted NDJSON or CSV")
+    export.add_argument("--format", choices=EXPORT_FORMATS,
+                        default="ndjson")
+    export.add_argument("-j", "--workers", type=int, default=0,
+                        help="number of processes (none by default)")
+    export.add_argument("--batch-size", type=int,
+                        help="rows fetched per round trip")
+
+    for command in (redact, export):
+        command.add_argument("-o", "--output",
+                             help="output file (standard output by default)")
+        command.add_argument("-f", "--field", action="append", dest="fields",
+                             help="field to redact (repeatable, PII_FIELDS "
+                                  "by default)")
+        command.add_argument("-r", "--redaction",
+                             default=RedactingFormatter.REDACTION)
+
+    args = parser.parse_args(argv)
+    fields = tuple(args.fields) if args.fields else PII_FIELDS
+
+    if args.command == "redact":
+        # The separator goes in the pattern and in the redacted text,
+        # so escaping it would write the escapes out
+        if _REGEX_METACHARACTERS.intersection(args.separator):
+            parser.error("the separator must not contain any of {}".format(
+                "".join(sorted(_REGEX_METACHARACTERS))))
+        chunk_size = max(args.chunk_size, 1) << 20
+        if args.output is None:
+            redact_file(args.file, sys.stdout.buffer, fields,
+                        args.redaction, args.separator, args.workers,
+                        chunk_size)
+            return 0
+        with open(args.output, "wb") as dst:
+            redact_file(args.file, dst, fields, args.redaction,
+                        args.separator, args.workers, chunk_size)
+        return 0
+
+    pool = get_pool()
+    try:
+        with pool.borrow() as db:
+            if args.output is None:
+                export_users(db, sys.stdout, args.format, fields,
+                             args.redaction, args.batch_size, args.workers)
+                return 0
+            with open(args.output, "w", newline="") as dst:
+                export_users(db, dst, args.format, fields, args.redaction,
+                             args.batch_size, args.workers)
+    finally:
+        pool.close()
+    return 0
+
+
+def main():
+    """
+    Retrieves and prints all rows in the users table with fields filtered.
+    """
+    logger = get_logger()
+    pool = get_pool()
+    try:
+        with pool.borrow() as db:
+            for message in user_lines(db):
+                logger.info(message)
+    finally:
+        pool.close()
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
     main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+""" Tests of the database connection pool, on stand-in connections
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from filtered_logger import ConnectionPool
+import threading
+import time
+import unittest
+
+
+class FakeConnection:
+    """ Stand-in for a database connection
+    """
+
+    def __init__(self, pool: ConnectionPool = None):
+        """ Initialize an open connection
+        """
+        self.pool = pool
+        self.connected = True
+        self.closed = False
+        self.checked_with_lock = []
+
+    def is_connected(self) -> bool:
+        """ Whether the connection is up, noting if the pool lock is held
+        """
+        if self.pool is not None:
+            self.checked_with_lock.append(_is_locked(self.pool))
+        return self.connected
+
+    def close(self):
+        """ Close the connection
+        """
+        self.closed = True
+
+
+def _is_locked(pool: ConnectionPool) -> bool:
+    """ Whether another thread holds the lock of a pool
+    """
+    result = []
+
+    def try_lock():
+        """ Try to take the lock without waiting """
+        acquired = pool._lock.acquire(blocking=False)
+        if acquired:
+            pool._lock.release()
+        result.append(not acquired)
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ Tests of ConnectionPool
+    """
+
+    def setUp(self):
+        """ Create a pool of two connections opened by a counter
+        """
+        self.opened = []
+        self.pool = ConnectionPool(self.connect, size=2, recycle=3600)
+
+    def connect(self) -> FakeConnection:
+        """ Open a stand-in connection
+        """
+        db = FakeConnection(self.pool)
+        self.opened.append(db)
+        return db
+
+    def test_reuse(self):
+        """ A released connection is borrowed again
+        """
+        with self.pool.borrow() as first:
+            pass
+        with self.pool.borrow() as second:
+            self.assertIs(second, first)
+        stats = self.pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 1)
+        self.assertEqual((stats["open"], stats["idle"], stats["in_use"]),
+                         (1, 1, 0))
+
+    def test_no_check_under_lock(self):
+        """ The connection is checked without holding the pool lock
+        """
+        with self.pool.borrow() as db:
+            pass
+        with self.pool.borrow():
+            pass
+        self.assertEqual(db.checked_with_lock, [False])
+
+    def test_wait_timeout(self):
+        """ Borrowers wait for a free connection, up to their timeout
+        """
+        first = self.pool.acquire()
+        self.pool.acquire()
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire(timeout=0.1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        threading.Timer(0.05, self.pool.release, (first,)).start()
+        self.assertIs(self.pool.acquire(timeout=5), first)
+        self.assertGreaterEqual(self.pool.stats()["waits"], 2)
+
+    def test_recycle(self):
+        """ Old and disconnected connections are replaced
+        """
+        self.pool.recycle = 0
+        with self.pool.borrow() as old:
+            pass
+        time.sleep(0.01)
+        with self.pool.borrow() as new:
+            self.assertIsNot(new, old)
+        self.assertTrue(old.closed)
+        self.pool.recycle = 3600
+        new.connected = False
+        with self.pool.borrow() as newer:
+            self.assertIsNot(newer, new)
+        self.assertTrue(new.closed)
+        stats = self.pool.stats()
+        self.assertEqual((stats["created"], stats["recycled"]), (3, 2))
+        self.assertEqual(stats["open"], 1)
+
+    def test_connect_error(self):
+        """ A failed connection frees its slot
+        """
+        def fail():
+            raise OSError("down")
+
+        pool = ConnectionPool(fail, size=1)
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                pool.acquire(timeout=0.1)
+        self.assertEqual(pool.stats()["open"], 0)
+
+    def test_close(self):
+        """ Close shuts the idle connections and frees their slots
+        """
+        idle = self.pool.acquire()
+        busy = self.pool.acquire()
+        self.pool.release(idle)
+        self.pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(busy.closed)
+        self.assertEqual(self.pool.stats()["open"], 1)
+        self.pool.release(busy)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+        stranger = FakeConnection()
+        self.pool.release(stranger)
+        self.assertTrue(stranger.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Tests of the redacting log formatters
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from filtered_logger import JSONRedactingFormatter, RedactingFormatter
+import json
+import logging
+import unittest
+
+
+FIELDS = ["name", "email"]
+
+
+def make_record(msg: str, args=None, **extra) -> logging.LogRecord:
+    """ Build a log record with arguments and extra attributes
+    """
+    record = logging.LogRecord("user_data", logging.INFO, __file__, 1, msg,
+                               None, None)
+    record.args = args
+    record.__dict__.update(extra)
+    return record
+
+
+class TestRedactingFormatter(unittest.TestCase):
+    """ Tests of RedactingFormatter and JSONRedactingFormatter
+    """
+
+    def test_message(self):
+        """ Fields of a plain message are redacted
+        """
+        record = make_record("name=bob;email=bob@x.com;ip=1;")
+        for structured in (False, True):
+            message = RedactingFormatter(FIELDS, structured).format(record)
+            self.assertTrue(message.endswith(": name=***;email=***;ip=1;"))
+
+    def test_dict_args(self):
+        """ Dict arguments, the format string and other values are all
+        redacted
+        """
+        record = make_record("name=bob;email=%(email)s;note=%(note)s",
+                             {"email": "bob@x.com", "note": "email=leak;"})
+        message = RedactingFormatter(FIELDS, True).format(record)
+        self.assertTrue(message.endswith(
+            ": name=***;email=***;note=email=***;"), message)
+        self.assertEqual(record.args["email"], "bob@x.com")
+
+    def test_json(self):
+        """ The JSON line redacts the message and the structured fields
+        """
+        record = make_record("name=bob;email=%(email)s;",
+                             {"email": "bob@x.com"}, name_hint="x",
+                             note="email=leak;")
+        document = json.loads(JSONRedactingFormatter(FIELDS).format(record))
+        self.assertEqual(document["message"], "name=***;email=***;")
+        self.assertEqual(document["fields"], {"email": "***",
+                                              "name_hint": "x",
+                                              "note": "email=***;"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+""" Tests of the redact command on a temporary log file
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from filtered_logger import cli
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+
+class TestRedact(unittest.TestCase):
+    """ Tests of the redact command
+    """
+
+    def setUp(self):
+        """ Write a log file in a temporary directory
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp_dir.name, "app.log")
+        self.output = os.path.join(self.tmp_dir.name, "redacted.log")
+
+    def tearDown(self):
+        """ Delete the temporary files
+        """
+        self.tmp_dir.cleanup()
+
+    def redact(self, content: str, *options: str) -> str:
+        """ Redact a log content with the command, return the output
+        """
+        with open(self.log, "w") as f:
+            f.write(content)
+        status = cli(["redact", "-o", self.output, "-j", "1", "-f", "name",
+                      "-f", "email", *options, self.log])
+        self.assertEqual(status, 0)
+        with open(self.output) as f:
+            return f.read()
+
+    def test_redact(self):
+        """ The fields are redacted on every line
+        """
+        self.assertEqual(
+            self.redact("name=bob;email=bob@x.com;ip=1;\nname=ann;ip=2;\n"),
+            "name=***;email=***;ip=1;\nname=***;ip=2;\n")
+        self.assertEqual(self.redact("name=bob,ip=1,\n", "-s", ","),
+                         "name=***,ip=1,\n")
+
+    def test_metacharacter_separator(self):
+        """ A separator that isn't taken literally is rejected
+        """
+        for separator in ("|", "."):
+            with contextlib.redirect_stderr(io.StringIO()):
+                with self.assertRaises(SystemExit) as cm:
+                    self.redact("name=bob|email=bob@x.com|\n",
+                                "-s", separator)
+            self.assertEqual(cm.exception.code, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
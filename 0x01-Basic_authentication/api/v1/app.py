@@ -4,14 +4,20 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
+from api.v1.auth.auth import PathMatcher
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
+from models.base import refresh_all
 
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
+# Paths that do not require authentication, compiled once
+PUBLIC_PATHS = PathMatcher(['/api/v1/status/',
+                            '/api/v1/unauthorized/', '/api/v1/forbidden/'])
+
 # Initialize the auth variable
 auth = None
 
@@ -49,12 +55,11 @@ def forbidden(error) -> str:
 @app.before_request
 def before_request():
     """Check if request is authorized before processing it"""
+    # Pick up the changes other workers made to the stored objects
+    refresh_all()
     if auth is None:
         return
-    # List of public endpoints that do not require authentication
-    public_endpoints = ['/api/v1/status/',
-                        '/api/v1/unauthorized/', '/api/v1/forbidden/']
-    if not auth.require_auth(request.path, public_endpoints):
+    if not auth.require_auth(request.path, PUBLIC_PATHS):
         return
     if auth.authorization_header(request) is None:
         abort(401)  # Unauthorized
@@ -2,13 +2,116 @@
 """ BasicAuth module
 """
 from api.v1.auth.auth import Auth
+from collections import OrderedDict
+from os import getenv
+from typing import Optional
 import base64
+import hashlib
+import os
+import threading
+import time
 from models.user import User
 
 
+# Verified Authorization headers kept, and for how many seconds
+CACHE_SIZE = int(getenv('BASIC_AUTH_CACHE_SIZE', 1024))
+CACHE_TTL = float(getenv('BASIC_AUTH_CACHE_TTL', 300))
+
+
+class CredentialCache():
+    """ Bounded LRU cache of verified Authorization headers
+
+    A header is stored as its hash keyed by a secret of the process, so
+    the cache never holds credentials, mapped to the id of its user and
+    the email and password hash it was checked against. An entry expires
+    after ttl seconds, and is dropped as soon as its user is removed or
+    saved with another email or password, by this process or another.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        """ Initialize an empty cache of at most size entries
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _hash(self, authorization_header: str) -> bytes:
+        """ Keyed hash of an Authorization header
+        """
+        return hashlib.blake2b(authorization_header.encode(),
+                               digest_size=16, key=self._key).digest()
+
+    @staticmethod
+    def _stamp(user: User) -> tuple:
+        """ Credentials of a user an entry is only valid for
+        """
+        return user.email, user.password
+
+    def get(self, authorization_header: str) -> Optional[User]:
+        """ User of a verified header, or None on a miss
+        """
+        key = self._hash(authorization_header)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        user = None
+        if entry is not None:
+            user_id, stamp, expires = entry
+            if expires > time.monotonic():
+                user = User.get(user_id)
+            if user is None or self._stamp(user) != stamp:
+                user = None
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+        with self._lock:
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return user
+
+    def put(self, authorization_header: str, user: User):
+        """ Remember a header verified for a user
+        """
+        if self.size <= 0:
+            return
+        key = self._hash(authorization_header)
+        entry = (user.id, self._stamp(user), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Drop all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """ Hit and miss counters and number of entries
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries)}
+
+
 class BasicAuth(Auth):
     """ BasicAuth class for basic authentication """
 
+    def __init__(self):
+        """ Initialize a BasicAuth with an empty credential cache
+        """
+        super().__init__()
+        self.credential_cache = CredentialCache()
+
     def extract_base64_authorization_header(self,
                                             authorization_header: str) -> str:
         """ Extracts the Base64 part of the Authorization header for Basic
@@ -93,6 +196,9 @@ class BasicAuth(Auth):
     def current_user(self, request=None) -> User:
         """ Retrieves the User instance for a request
 
+        A header already verified is looked up in the credential cache
+        instead of being decoded and checked again.
+
         Args:
             request: The Flask request object
 
@@ -102,6 +208,9 @@ class BasicAuth(Auth):
         auth_header = self.authorization_header(request)
         if auth_header is None:
             return None
+        user = self.credential_cache.get(auth_header)
+        if user is not None:
+            return user
         base64_auth = self.extract_base64_authorization_header(auth_header)
         if base64_auth is None:
             return None
@@ -111,4 +220,7 @@ class BasicAuth(Auth):
         email, password = self.extract_user_credentials(decoded_auth)
         if email is None or password is None:
             return None
-        return self.user_object_from_credentials(email, password)
+        user = self.user_object_from_credentials(email, password)
+        if user is not None:
+            self.credential_cache.put(auth_header, user)
+        return user
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+""" Query module
+
+Queries on the objects of a class, built by Base.query():
+
+    User.query().filter(email__prefix="admin", created_at__gt=since) \\
+        .order_by("-created_at").limit(20)
+
+A condition is attr=value for equality, or attr__op=value with op one of
+OPERATORS. The storage engine plans the query onto its indexes; a query
+is only run when iterated, counted or listed.
+"""
+from datetime import datetime
+from heapq import nlargest, nsmallest
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+import operator
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+_COMPARISONS = {
+    'lt': operator.lt,
+    'le': operator.le,
+    'gt': operator.gt,
+    'ge': operator.ge,
+}
+OPERATORS = ('eq', 'in', 'prefix') + tuple(_COMPARISONS)
+
+
+def match_value(op: str, actual: object, value: object) -> bool:
+    """ Check a value against the operand of an operator
+    """
+    try:
+        if op == 'eq':
+            return actual == value
+        if op == 'in':
+            return actual in value
+        if op == 'prefix':
+            return isinstance(actual, str) and actual.startswith(value)
+        return actual is not None and _COMPARISONS[op](actual, value)
+    except TypeError:
+        # Values of different types match no comparison
+        return False
+
+
+class Query():
+    """ Query on the objects of a class
+    """
+
+    def __init__(self, cls: type, predicates: Tuple[tuple, ...] = (),
+                 order: str = None, limit: int = None, offset: int = 0):
+        """ Initialize a query of all objects of a class
+        """
+        self.cls = cls
+        self.predicates = predicates
+        self.order = order
+        self.max_count = limit
+        self.skip = offset
+
+    def _copy(self, **changes: dict) -> 'Query':
+        """ Copy of the query with some of its parameters changed
+        """
+        parameters = {'predicates': self.predicates, 'order': self.order,
+                      'limit': self.max_count, 'offset': self.skip}
+        parameters.update(changes)
+        return Query(self.cls, **parameters)
+
+    def filter(self, **conditions: dict) -> 'Query':
+        """ Query also requiring conditions
+
+        Timestamps can be compared with strings in TIMESTAMP_FORMAT.
+        """
+        predicates = list(self.predicates)
+        for key, value in conditions.items():
+            attr, _, op = key.partition('__')
+            op = op or 'eq'
+            if op not in OPERATORS:
+                raise ValueError("unknown operator {}".format(op))
+            if op == 'in':
+                value = tuple(value)
+            elif isinstance(value, str) and op != 'prefix' and \
+                    attr in ('created_at', 'updated_at'):
+                value = datetime.strptime(value, TIMESTAMP_FORMAT)
+            predicates.append((attr, op, value))
+        return self._copy(predicates=tuple(predicates))
+
+    def order_by(self, attr: Optional[str]) -> 'Query':
+        """ Query ordered by an attribute, descending if prefixed with "-"
+
+        Objects without the attribute come last.
+        """
+        return self._copy(order=attr)
+
+    def limit(self, limit: Optional[int]) -> 'Query':
+        """ Query of at most limit objects
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("limit must not be negative")
+        return self._copy(limit=limit)
+
+    def offset(self, offset: int) -> 'Query':
+        """ Query skipping the first offset objects
+        """
+        if offset < 0:
+            raise ValueError("offset must not be negative")
+        return self._copy(offset=offset)
+
+    @property
+    def order_attr(self) -> Optional[str]:
+        """ Attribute of the order, without its direction
+        """
+        return None if self.order is None else self.order.lstrip('-')
+
+    @property
+    def descending(self) -> bool:
+        """ Whether the order is descending
+        """
+        return self.order is not None and self.order.startswith('-')
+
+    def matches(self, obj: object) -> bool:
+        """ Check an object against all conditions
+        """
+        return all(match_value(op, getattr(obj, attr, None), value)
+                   for attr, op, value in self.predicates)
+
+    def arrange(self, objs: Iterable[object], ordered: bool = False
+                ) -> Iterator[object]:
+        """ Order matching objects, unless they already are, then apply
+        the offset and the limit
+        """
+        if self.order is not None and not ordered:
+            attr = self.order_attr
+
+            def key(obj):
+                value = getattr(obj, attr, None)
+                return (value is None) != self.descending, value
+
+            if self.max_count is None:
+                objs = sorted(objs, key=key, reverse=self.descending)
+            else:
+                select = nlargest if self.descending else nsmallest
+                objs = select(self.skip + self.max_count, objs, key=key)
+        stop = None if self.max_count is None else self.skip + self.max_count
+        return islice(objs, self.skip, stop)
+
+    def apply_window(self, total: int) -> int:
+        """ Number of objects left of total by the offset and the limit
+        """
+        total = max(0, total - self.skip)
+        if self.max_count is None:
+            return total
+        return min(total, self.max_count)
+
+    def __iter__(self) -> Iterator[object]:
+        """ Iterate lazily over the matching objects
+        """
+        return self.cls._run_query(self)
+
+    def all(self) -> List[object]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> Optional[object]:
+        """ First matching object, or None
+        """
+        return next(iter(self.limit(1)), None)
+
+    def count(self) -> int:
+        """ Number of matching objects, counted on the indexes when they
+        decide every condition
+        """
+        return self.cls._count_query(self)
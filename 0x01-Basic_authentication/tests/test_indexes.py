@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Tests of the indexes of Base, in a temporary directory
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from models import base
+from models.user import User
+import json
+import os
+import tempfile
+import unittest
+
+
+class TestIndexes(unittest.TestCase):
+    """ Tests of the hash indexes of Base
+    """
+
+    def setUp(self):
+        """ Load the users of an empty temporary directory
+        """
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        User.load_from_file()
+
+    def tearDown(self):
+        """ Go back to the project directory
+        """
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_layout(self):
+        """ A value held by one object maps to its id, by several to a
+        dict of ids, and the indexed values are kept by attribute
+        """
+        bob = User(email="bob@example.com")
+        bob.save()
+        self.assertEqual(base.INDEX_DATA['User']['email'],
+                         {"bob@example.com": bob.id})
+        self.assertEqual(base.INDEXED_VALUES['User'],
+                         {'email': {bob.id: "bob@example.com"}})
+        bob.email = "robert@example.com"
+        bob.save()
+        self.assertEqual(base.INDEX_DATA['User']['email'],
+                         {"robert@example.com": bob.id})
+        bob.remove()
+        self.assertEqual(base.INDEX_DATA['User']['email'], {})
+        self.assertEqual(base.INDEXED_VALUES['User'], {'email': {}})
+
+    def test_unique(self):
+        """ A duplicate value of a unique index is rejected
+        """
+        User(email="bob@example.com").save()
+        with self.assertRaises(ValueError):
+            User(email="bob@example.com").save()
+        self.assertEqual(User.count(), 1)
+        self.assertEqual(len(User.search({'email': "bob@example.com"})), 1)
+
+    def test_legacy_duplicates(self):
+        """ Duplicates saved before the index existed are kept and can
+        still be saved unchanged
+        """
+        first = User(email="bob@example.com")
+        second = User(email="bob@example.com")
+        with open(".db_User.json", "w") as f:
+            json.dump({user.id: user.to_json(True)
+                       for user in (first, second)}, f)
+        User.load_from_file()
+        self.assertEqual(base.INDEX_DATA['User']['email'],
+                         {"bob@example.com": {first.id: None,
+                                              second.id: None}})
+        found = User.get(second.id)
+        found.first_name = "Bob"
+        found.save()
+        self.assertEqual(len(User.search({'email': "bob@example.com"})), 2)
+        User.get(first.id).remove()
+        self.assertEqual(base.INDEX_DATA['User']['email'],
+                         {"bob@example.com": second.id})
+        self.assertEqual([u.id for u in User.query().filter(
+            email__prefix="bob")], [second.id])
+
+
+if __name__ == "__main__":
+    unittest.main()
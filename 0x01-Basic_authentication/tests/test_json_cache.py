@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+""" Tests of the cached JSON forms of Base objects
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from models.user import User
+import json
+import unittest
+
+
+class TestJSONCache(unittest.TestCase):
+    """ Tests of Base.to_json and Base.to_json_str
+    """
+
+    def test_view_cached(self):
+        """ The view form is cached until the next attribute write
+        """
+        user = User(email="bob@example.com")
+        first = user.to_json()
+        self.assertEqual(user.to_json(), first)
+        self.assertEqual(set(user._json_cache), {False})
+        user.first_name = "Bob"
+        self.assertIsNone(user._json_cache)
+        self.assertEqual(user.to_json()['first_name'], "Bob")
+
+    def test_serialization_not_cached(self):
+        """ The serialization form is built each time, and kept nowhere
+        """
+        user = User(email="bob@example.com", password="pwd")
+        self.assertIn('_password', user.to_json(True))
+        self.assertNotIn('_password', user.to_json())
+        self.assertEqual(set(user._json_cache), {False})
+
+    def test_json_str(self):
+        """ The JSON document is encoded as jsonify does, without caching
+        the dictionary
+        """
+        user = User(email="bob@example.com", first_name="Bob")
+        self.assertEqual(user.to_json_str(), json.dumps(
+            user._build_json(False), sort_keys=True, separators=(',', ':')))
+        self.assertEqual(set(user._json_cache), {'str'})
+        user.first_name = "Robert"
+        self.assertIn('"first_name":"Robert"', user.to_json_str())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" Tests of the persistence modes of Base shared by several processes,
+in a temporary directory
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Saves users while picking up the changes of the other processes, and
+# saves and removes one more every 10 users
+WORKER = """
+import os, random, sys, time
+from models.base import refresh_all
+from models.user import User
+User.load_from_file()
+for i in range(int(sys.argv[1])):
+    refresh_all()
+    User(email="{}-{}@example.com".format(os.getpid(), i)).save()
+    time.sleep(random.random() * 0.005)
+    if i % 10 == 9:
+        user = User(email="tmp-{}-{}@example.com".format(os.getpid(), i))
+        user.save()
+        user.remove()
+User.wait_durable(10)
+"""
+
+CHECK = """
+from models.user import User
+User.load_from_file()
+print(User.count(), len(User.search({"email": "%s"})))
+"""
+
+
+class TestPersistence(unittest.TestCase):
+    """ Several processes writing the same class lose none of the changes
+    """
+
+    def setUp(self):
+        """ Create a temporary directory for the files
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        """ Delete the files
+        """
+        self.tmp_dir.cleanup()
+
+    def run_workers(self, persistence: str, snapshot_format: str = 'json',
+                    processes: int = 3, saves: int = 40, **env: str):
+        """ Run worker processes, then check that a new process finds all
+        their users, and that no temporary file is left
+        """
+        env = dict(os.environ, PYTHONPATH=PROJECT_DIR,
+                   BASE_PERSISTENCE=persistence,
+                   BASE_SNAPSHOT_FORMAT=snapshot_format,
+                   BASE_FLUSH_INTERVAL='0.01', **env)
+        workers = [subprocess.Popen(
+            [sys.executable, '-c', WORKER, str(saves)],
+            cwd=self.tmp_dir.name, env=env, stderr=subprocess.PIPE,
+            universal_newlines=True) for _ in range(processes)]
+        for worker in workers:
+            _, errors = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0, errors)
+        email = "{}-0@example.com".format(workers[0].pid)
+        output = subprocess.run(
+            [sys.executable, '-c', CHECK % email], cwd=self.tmp_dir.name,
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True).stdout
+        self.assertEqual(output.split(), [str(processes * saves), '1'])
+        self.assertEqual(
+            glob.glob(os.path.join(self.tmp_dir.name, '*.tmp')), [])
+
+    def test_file(self):
+        """ Snapshots rewritten on every change
+        """
+        self.run_workers('file')
+
+    def test_file_binary(self):
+        """ Binary snapshots rewritten on every change
+        """
+        self.run_workers('file', 'binary')
+
+    def test_journal(self):
+        """ Journals compacted many times
+        """
+        self.run_workers('journal', BASE_JOURNAL_MAX_BYTES='3000')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp_dir.name, '.db_User.json')))
+
+    def test_group(self):
+        """ Group commits of each process
+        """
+        self.run_workers('group')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+""" Tests of the binary snapshots, in a temporary directory
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from models import base
+from models.snapshot import Pending, json_to_snapshot
+from models.user import User
+from unittest import mock
+import json
+import os
+import tempfile
+import unittest
+
+
+class TestSnapshot(unittest.TestCase):
+    """ Tests of the lazily loaded binary snapshots
+    """
+
+    def setUp(self):
+        """ Write the JSON file of 100 users in a temporary directory
+        """
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        users = [User(email="{}@example.com".format(i)) for i in range(100)]
+        self.ids = [user.id for user in users]
+        with open(".db_User.json", "w") as f:
+            json.dump({user.id: user.to_json(True) for user in users}, f)
+        patcher = mock.patch.object(base, 'SNAPSHOT_FORMAT', 'binary')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """ Go back to the project directory
+        """
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def built(self) -> int:
+        """ Number of users built from the snapshot
+        """
+        return sum(1 for _, obj in base.DATA['User'].entries()
+                   if type(obj) is not Pending)
+
+    def check_lazy_load(self):
+        """ Load the snapshot: no user is built, the index works
+        """
+        User.load_from_file()
+        self.assertEqual(User.count(), 100)
+        self.assertEqual(self.built(), 0)
+        found = User.search({'email': "7@example.com"})
+        self.assertEqual([user.id for user in found], [self.ids[7]])
+        self.assertEqual(self.built(), 1)
+
+    def test_indexed_header(self):
+        """ A snapshot holding the indexed values is loaded lazily
+        """
+        json_to_snapshot(".db_User.json", ".db_User.snap", User.INDEXES)
+        self.check_lazy_load()
+
+    def test_missing_index(self):
+        """ A snapshot converted without the indexes is loaded lazily too
+        """
+        json_to_snapshot(".db_User.json", ".db_User.snap")
+        self.check_lazy_load()
+        with self.assertRaises(ValueError):
+            User(email="7@example.com").save()
+
+
+if __name__ == "__main__":
+    unittest.main()
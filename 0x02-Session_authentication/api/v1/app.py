@@ -4,19 +4,25 @@ Route module for the API
 """
 from os import getenv
 from api.v1.views import app_views
-from api.v1.auth.auth import Auth
+from api.v1.auth.auth import Auth, PathMatcher
 from api.v1.auth.basic_auth import BasicAuth
 from api.v1.auth.session_auth import SessionAuth
 from api.v1.auth.session_db_auth import SessionDBAuth
 from api.v1.auth.session_exp_auth import SessionExpAuth
-from flask import Flask, jsonify, abort, request
+from flask import Flask, jsonify, abort, g, request
 from flask_cors import (CORS, cross_origin)
+from models.base import refresh_all
 
 
 app = Flask(__name__)
 app.register_blueprint(app_views)
 CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 
+# Paths that do not require authentication, compiled once
+PUBLIC_PATHS = PathMatcher(['/api/v1/status/',
+                            '/api/v1/unauthorized/', '/api/v1/forbidden/',
+                            '/api/v1/auth_session/login/'])
+
 # Initialize the auth variable
 auth = None
 
@@ -24,8 +30,7 @@ auth = None
 auth_type = getenv('AUTH_TYPE')
 if auth_type == 'basic_auth':
     auth = BasicAuth()
-    auth_type = os.getenv('AUTH_TYPE')
-if auth_type == 'session_db_auth':
+elif auth_type == 'session_db_auth':
     auth = SessionDBAuth()
 elif auth_type == 'session_exp_auth':
     auth = SessionExpAuth()
@@ -58,20 +63,23 @@ def forbidden(error) -> str:
 
 @app.before_request
 def before_request():
-    """Check if request is authorized before processing it"""
+    """Check if request is authorized before processing it, and resolve
+    its user once for the views as request.current_user (and
+    g.current_user), None on public paths"""
+    # Pick up the changes other workers made to the stored objects
+    refresh_all()
+    request.current_user = g.current_user = None
     if auth is None:
         return
-    # List of public endpoints that do not require authentication
-    public_endpoints = ['/api/v1/status/',
-                        '/api/v1/unauthorized/', '/api/v1/forbidden/',
-                        '/api/v1/auth_session/login/']
-    if not auth.require_auth(request.path, public_endpoints):
+    if not auth.require_auth(request.path, PUBLIC_PATHS):
         return
     if auth.authorization_header(
             request) is None and auth.session_cookie(request) is None:
         abort(401)  # Unauthorized
-    if auth.current_user(request) is None:
+    user = auth.current_user(request)
+    if user is None:
         abort(403)  # Forbidden
+    request.current_user = g.current_user = user
 
 
 if __name__ == "__main__":
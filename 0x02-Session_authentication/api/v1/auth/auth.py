@@ -1,23 +1,91 @@
 #!/usr/bin/env python3
 """ Auth module
 """
-from typing import List, TypeVar
+from functools import lru_cache
+from typing import Iterable, List, TypeVar, Union
 from flask import request
 import os
 
 User = TypeVar('User')
 
 
+def normalize_path(path: str) -> str:
+    """ Path with a leading slash, without repeated or trailing slashes
+    """
+    return '/' + '/'.join(part for part in path.split('/') if part)
+
+
+class PathMatcher():
+    """ Compiled list of excluded paths
+
+    A path matches an entry if they are equal once normalized, or if the
+    entry ends with "*" and the path, with or without a trailing slash,
+    starts with the rest of the entry. Entries are kept in a table of
+    exact paths and a table of wildcard prefixes by length, so matching
+    costs one lookup per distinct prefix length, and each path's decision
+    is memoized.
+    """
+
+    def __init__(self, paths: Iterable[str], cache_size: int = 4096):
+        """ Compile a list of excluded paths
+        """
+        self.paths = tuple(paths)
+        self._exact = set()
+        prefixes = {}
+        for entry in self.paths:
+            if entry.endswith('*'):
+                prefix = entry[:-1]
+                # Keep a trailing slash: "/static/*" doesn't match
+                # "/statics"
+                normalized = normalize_path(prefix)
+                if prefix.endswith('/') and normalized != '/':
+                    normalized += '/'
+                prefixes.setdefault(len(normalized), set()).add(normalized)
+            else:
+                self._exact.add(normalize_path(entry))
+        self._prefixes = sorted(prefixes.items())
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def __bool__(self) -> bool:
+        """ Whether there is any excluded path
+        """
+        return bool(self.paths)
+
+    def _match(self, path: str) -> bool:
+        """ Check if a path is excluded
+        """
+        path = normalize_path(path)
+        if path in self._exact:
+            return True
+        slashed = path if path == '/' else path + '/'
+        for length, prefixes in self._prefixes:
+            if length > len(slashed):
+                break
+            if path[:length] in prefixes or slashed[:length] in prefixes:
+                return True
+        return False
+
+
+@lru_cache(maxsize=64)
+def _compile(paths: tuple) -> PathMatcher:
+    """ Matcher of a list of excluded paths, compiled once
+    """
+    return PathMatcher(paths)
+
+
 class Auth:
     """ Auth class to manage API authentication
     """
-    def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
+    def require_auth(self, path: str,
+                     excluded_paths: Union[List[str], PathMatcher]) -> bool:
         """ Determine if authentication is required for the given path
 
         Args:
             path (str): The request path
-            excluded_paths (List[str]): List of paths that do not require
-            authentication
+            excluded_paths (List[str] or PathMatcher): Paths that do not
+            require authentication, "*" ending an entry matching any
+            suffix; compile them once into a PathMatcher to avoid
+            doing it on each call
 
         Returns:
             bool: True if authentication is required, False otherwise
@@ -25,9 +93,9 @@ class Auth:
         # If path is None, authentication is required
         if path is None or excluded_paths is None or not excluded_paths:
             return True
-        if path in excluded_paths or path + '/' in excluded_paths:
-            return False
-        return True
+        if not isinstance(excluded_paths, PathMatcher):
+            excluded_paths = _compile(tuple(excluded_paths))
+        return not excluded_paths.match(path)
 
     def authorization_header(self, request=None) -> str:
         """ Get the authorization header from the request
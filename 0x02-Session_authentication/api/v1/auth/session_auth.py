@@ -2,31 +2,103 @@
 """ Session authentication module """
 
 import uuid
+from collections.abc import Mapping, MutableMapping
+from datetime import datetime
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_store import SessionStore, get_session_store
 from models.user import User
 
 
+class SessionsById(MutableMapping):
+    """ Sessions of a SessionAuth by id, read and written through its
+    store, as the user_id_by_session_id dictionary it had before """
+
+    def __init__(self, auth):
+        """ Initialize the view of the sessions of auth """
+        self.auth = auth
+
+    def __getitem__(self, session_id):
+        """ Entry of a session, as the auth kept it """
+        session = self.auth.session_store.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return self.auth.session_entry(session)
+
+    def __setitem__(self, session_id, entry):
+        """ Store a session from a user ID, or from a dictionary with a
+        user_id and created_at """
+        if isinstance(entry, Mapping):
+            user_id = entry['user_id']
+            created_at = entry.get('created_at') or datetime.now()
+        else:
+            user_id = entry
+            created_at = datetime.now()
+        self.auth.session_store.set(session_id, user_id, created_at,
+                                    self.auth.session_expiry(created_at))
+
+    def __delitem__(self, session_id):
+        """ Delete a session """
+        if not self.auth.session_store.delete(session_id):
+            raise KeyError(session_id)
+
+    def __iter__(self):
+        """ Iterate over the session IDs """
+        return iter(self.auth.session_store.session_ids())
+
+    def __len__(self):
+        """ Number of sessions """
+        return len(self.auth.session_store.session_ids())
+
+
 class SessionAuth(Auth):
     """ SessionAuth class """
 
-    def __init__(self):
-        """ Initialize SessionAuth """
+    # Session store used if SESSION_STORE isn't set
+    default_store = 'memory'
+
+    def __init__(self, session_store: SessionStore = None):
+        """ Initialize SessionAuth with a session store, the one selected
+        by SESSION_STORE by default """
         super().__init__()
-        self.user_id_by_session_id = {}
+        if session_store is None:
+            session_store = get_session_store(default=self.default_store)
+        self.session_store = session_store
+
+    @property
+    def user_id_by_session_id(self) -> SessionsById:
+        """ The sessions by ID, kept in the session store """
+        return SessionsById(self)
+
+    def session_entry(self, session):
+        """ Entry of a session in user_id_by_session_id: its user ID """
+        return session['user_id']
 
     def create_session(self, user_id=None):
         """ Create a new session """
         if user_id is None or not isinstance(user_id, str):
             return None
         session_id = str(uuid.uuid4())
-        self.user_id_by_session_id[session_id] = user_id
+        now = datetime.now()
+        self.session_store.set(session_id, user_id, now,
+                               self.session_expiry(now))
         return session_id
 
-    def user_id_for_session_id(self, session_id=None):
-        """ Get user ID from session ID """
+    def session_expiry(self, created_at):
+        """ Expiry of a session created at created_at, None as sessions
+        don't expire """
+        return None
+
+    def session_for_session_id(self, session_id=None):
+        """ Get the session (user_id, created_at and expires_at) of a
+        session ID """
         if session_id is None or not isinstance(session_id, str):
             return None
-        return self.user_id_by_session_id.get(session_id)
+        return self.session_store.get(session_id)
+
+    def user_id_for_session_id(self, session_id=None):
+        """ Get user ID from session ID """
+        session = self.session_for_session_id(session_id)
+        return None if session is None else session.get('user_id')
 
     def current_user(self, request=None) -> User:
         """ Return a User instance based on a session cookie """
@@ -35,3 +107,12 @@ class SessionAuth(Auth):
         session_id = self.session_cookie(request)
         user_id = self.user_id_for_session_id(session_id)
         return User.get(user_id) if user_id else None
+
+    def destroy_session(self, request=None):
+        """ Delete the session of a request's cookie """
+        if request is None:
+            return False
+        session_id = self.session_cookie(request)
+        if self.user_id_for_session_id(session_id) is None:
+            return False
+        return self.session_store.delete(session_id)
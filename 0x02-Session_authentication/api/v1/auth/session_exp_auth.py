@@ -4,34 +4,54 @@
 from datetime import datetime, timedelta
 import os
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_store import start_sweeper
 
 
 class SessionExpAuth(SessionAuth):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, session_store=None):
+        super().__init__(session_store)
         try:
             self.session_duration = int(os.getenv('SESSION_DURATION', 0))
         except ValueError:
             self.session_duration = 0
+        # Expired sessions deleted by a create_session, when no thread
+        # sweeps them every SESSION_SWEEP_INTERVAL seconds
+        try:
+            self.sweep_batch = int(os.getenv('SESSION_SWEEP_BATCH', 100))
+        except ValueError:
+            self.sweep_batch = 100
+        try:
+            interval = float(os.getenv('SESSION_SWEEP_INTERVAL', 0))
+        except ValueError:
+            interval = 0
+        self.sweeper = None
+        if interval > 0 and self.session_duration > 0:
+            self.sweeper = start_sweeper(self.session_store, interval)
 
-    def create_session(self, user_id=None):
-        """ Create a Session ID and store it with expiration """
-        session_id = super().create_session(user_id)
-        if session_id is None:
+    def session_expiry(self, created_at):
+        """ Expiry of a session created at created_at, None if sessions
+        don't expire """
+        if self.session_duration <= 0:
             return None
+        return created_at + timedelta(seconds=self.session_duration)
+
+    def session_entry(self, session):
+        """ Entry of a session in user_id_by_session_id: its user ID and
+        creation time """
+        return {'user_id': session['user_id'],
+                'created_at': session['created_at']}
 
-        self.user_id_by_session_id[session_id] = {
-            'user_id': user_id,
-            'created_at': datetime.now()
-        }
+    def create_session(self, user_id=None):
+        """ Create a new session, sweeping a batch of expired ones """
+        session_id = super().create_session(user_id)
+        if session_id is not None and self.sweeper is None and \
+                self.session_duration > 0:
+            self.session_store.sweep(limit=self.sweep_batch)
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
         """ Return the user_id for a session_id if it's not expired """
-        if session_id is None:
-            return None
-
-        session = self.user_id_by_session_id.get(session_id)
+        session = self.session_for_session_id(session_id)
         if session is None:
             return None
 
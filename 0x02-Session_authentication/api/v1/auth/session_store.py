@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+""" Session store module
+
+Where the session auths keep their sessions, selected by SESSION_STORE:
+- "memory": a dictionary of the process (default)
+- "sqlite": a SQLite database in WAL mode, SESSION_STORE_PATH, shared by
+  all processes and kept across restarts
+- "socket": a server on the Unix socket SESSION_STORE_PATH, started with
+
+      python3 -m api.v1.auth.session_store SOCKET_PATH [--sqlite FILE]
+
+  Requests and responses are JSON documents, one per line, so anything
+  speaking this protocol (a test stand-in) can replace the server. A
+  request that fails is answered with {"error": ...}, raised by the
+  client as SessionStoreError.
+
+A session is a dictionary with its user_id, created_at and expires_at
+(datetimes, expires_at None if it doesn't expire). An expired session is
+never returned, and sweep() deletes them. A store holds at most
+SESSION_MAX_COUNT sessions (0: no limit), evicting the oldest ones.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from os import getenv
+from typing import List, Optional
+import argparse
+import heapq
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+
+
+MAX_SESSIONS = int(getenv('SESSION_MAX_COUNT', 0))
+
+
+class SessionStoreError(Exception):
+    """ Error returned by a session store server
+    """
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    """ POSIX timestamp of a datetime, None staying None
+    """
+    return None if value is None else value.timestamp()
+
+
+def _datetime(value: Optional[float]) -> Optional[datetime]:
+    """ Datetime of a POSIX timestamp, None staying None
+    """
+    return None if value is None else datetime.fromtimestamp(value)
+
+
+class SessionStore():
+    """ Interface of the session stores
+    """
+
+    def set(self, session_id: str, user_id: str, created_at: datetime,
+            expires_at: datetime = None):
+        """ Store a session
+        """
+        raise NotImplementedError
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """ Session of an id, or None if missing or expired
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        """ Delete a session, return False if there was none
+        """
+        raise NotImplementedError
+
+    def session_ids(self) -> List[str]:
+        """ Ids of all the sessions, expired ones included until swept
+        """
+        raise NotImplementedError
+
+    def sweep(self, now: datetime = None, limit: int = None) -> int:
+        """ Delete up to limit sessions expired at now, and return how
+        many were
+        """
+        return 0
+
+    def stats(self) -> dict:
+        """ Number of sessions, and of sessions expired and evicted
+        """
+        return {}
+
+    def close(self):
+        """ Release the resources of the store
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """ Sessions in a dictionary of the process
+
+    The sessions which expire are also in a min-heap by expiry, so a
+    sweep only visits expired ones. The dictionary keeps the order of
+    creation, to evict the oldest sessions past max_sessions.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        """ Initialize an empty store
+        """
+        self.sessions = OrderedDict()
+        self.max_sessions = max_sessions
+        self.expired = 0
+        self.evicted = 0
+        self._expiries = []
+        self._lock = threading.Lock()
+
+    def set(self, session_id: str, user_id: str, created_at: datetime,
+            expires_at: datetime = None):
+        """ Store a session
+        """
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            self.sessions[session_id] = {'user_id': user_id,
+                                         'created_at': created_at,
+                                         'expires_at': expires_at}
+            if expires_at is not None:
+                heapq.heappush(self._expiries, (expires_at, session_id))
+            while 0 < self.max_sessions < len(self.sessions):
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            if len(self._expiries) > 2 * len(self.sessions) + 1024:
+                # Mostly entries of sessions deleted or evicted since
+                self._expiries = [
+                    (session['expires_at'], session_id)
+                    for session_id, session in self.sessions.items()
+                    if session['expires_at'] is not None]
+                heapq.heapify(self._expiries)
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """ Session of an id, or None if missing or expired
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        expires_at = session['expires_at']
+        if expires_at is not None and expires_at <= datetime.now():
+            with self._lock:
+                if self.sessions.get(session_id) is session:
+                    del self.sessions[session_id]
+                    self.expired += 1
+            return None
+        return dict(session)
+
+    def delete(self, session_id: str) -> bool:
+        """ Delete a session, return False if there was none
+        """
+        with self._lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def session_ids(self) -> List[str]:
+        """ Ids of all the sessions, expired ones included until swept
+        """
+        with self._lock:
+            return list(self.sessions)
+
+    def sweep(self, now: datetime = None, limit: int = None) -> int:
+        """ Delete up to limit sessions expired at now, and return how
+        many were
+        """
+        if now is None:
+            now = datetime.now()
+        removed = 0
+        with self._lock:
+            while self._expiries and self._expiries[0][0] <= now and \
+                    (limit is None or removed < limit):
+                expires_at, session_id = heapq.heappop(self._expiries)
+                session = self.sessions.get(session_id)
+                # Skip the entries of sessions deleted or set again
+                if session is not None and \
+                        session['expires_at'] == expires_at:
+                    del self.sessions[session_id]
+                    removed += 1
+            self.expired += removed
+        return removed
+
+    def stats(self) -> dict:
+        """ Number of sessions, and of sessions expired and evicted
+        """
+        with self._lock:
+            return {'sessions': len(self.sessions), 'expired': self.expired,
+                    'evicted': self.evicted}
+
+
+class SQLiteSessionStore(SessionStore):
+    """ Sessions in a SQLite database shared by all processes
+
+    The oldest sessions past max_sessions are evicted when a session is
+    stored, found by the index on created_at. The expired and evicted
+    counters are those of this process.
+    """
+
+    def __init__(self, file_path: str, timeout: float = 30,
+                 max_sessions: int = MAX_SESSIONS):
+        """ Initialize a store on a database file, created if needed
+        """
+        self.file_path = file_path
+        self.timeout = timeout
+        self.max_sessions = max_sessions
+        self.expired = 0
+        self.evicted = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "session_id TEXT PRIMARY KEY, "
+                         "user_id TEXT NOT NULL, "
+                         "created_at REAL NOT NULL, "
+                         "expires_at REAL)")
+            columns = {row[1] for row in conn.execute(
+                "PRAGMA table_info(sessions)")}
+            if 'expires_at' not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN expires_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at "
+                         "ON sessions (expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_created_at "
+                         "ON sessions (created_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, reopened after a fork
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def set(self, session_id: str, user_id: str, created_at: datetime,
+            expires_at: datetime = None):
+        """ Store a session
+        """
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES "
+                         "(?, ?, ?, ?)", (session_id, user_id,
+                                          created_at.timestamp(),
+                                          _timestamp(expires_at)))
+            evicted = 0
+            if self.max_sessions > 0:
+                count = conn.execute(
+                    "SELECT COUNT(*) FROM sessions").fetchone()[0]
+                if count > self.max_sessions:
+                    evicted = conn.execute(
+                        "DELETE FROM sessions WHERE session_id IN ("
+                        "SELECT session_id FROM sessions "
+                        "ORDER BY created_at LIMIT ?)",
+                        (count - self.max_sessions,)).rowcount
+        self.evicted += evicted
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """ Session of an id, or None if missing or expired
+        """
+        row = self._connection().execute(
+            "SELECT user_id, created_at, expires_at FROM sessions "
+            "WHERE session_id = ? AND (expires_at IS NULL OR "
+            "expires_at > ?)", (session_id, time.time())).fetchone()
+        if row is None:
+            return None
+        return {'user_id': row[0], 'created_at': _datetime(row[1]),
+                'expires_at': _datetime(row[2])}
+
+    def delete(self, session_id: str) -> bool:
+        """ Delete a session, return False if there was none
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def session_ids(self) -> List[str]:
+        """ Ids of all the sessions, expired ones included until swept
+        """
+        return [row[0] for row in self._connection().execute(
+            "SELECT session_id FROM sessions ORDER BY created_at")]
+
+    def sweep(self, now: datetime = None, limit: int = None) -> int:
+        """ Delete up to limit sessions expired at now, and return how
+        many were
+        """
+        now = time.time() if now is None else now.timestamp()
+        with self._connection() as conn:
+            removed = conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions WHERE expires_at <= ? "
+                "LIMIT ?)", (now, -1 if limit is None else limit)).rowcount
+        self.expired += removed
+        return removed
+
+    def stats(self) -> dict:
+        """ Number of sessions, and of sessions expired and evicted
+        """
+        count = self._connection().execute(
+            "SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {'sessions': count, 'expired': self.expired,
+                'evicted': self.evicted}
+
+    def close(self):
+        """ Close the connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SocketSessionStore(SessionStore):
+    """ Sessions in a session store server on a Unix socket
+    """
+
+    def __init__(self, address: str, timeout: float = 5):
+        """ Initialize a client of the server at address
+        """
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        """ Connection of the current thread, as a file
+        """
+        f = getattr(self._local, 'file', None)
+        if f is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+            f = self._local.file = sock.makefile('rwb')
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return f
+
+    def _call(self, request: dict, key: str) -> object:
+        """ Send a request and return the value of key in the response,
+        reconnecting once if the connection was lost
+
+        Raise SessionStoreError if the server answers with an error
+        """
+        line = json.dumps(request).encode() + b"\n"
+        for attempt in range(2):
+            try:
+                f = self._connect()
+                f.write(line)
+                f.flush()
+                response = f.readline()
+                if not response:
+                    raise ConnectionError(
+                        "session store closed the connection")
+                break
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+        try:
+            response = json.loads(response)
+        except ValueError:
+            pass
+        if isinstance(response, dict) and 'error' in response:
+            raise SessionStoreError(response['error'])
+        if not isinstance(response, dict) or key not in response:
+            raise SessionStoreError("unexpected response {!r}".format(
+                response))
+        return response[key]
+
+    def set(self, session_id: str, user_id: str, created_at: datetime,
+            expires_at: datetime = None):
+        """ Store a session
+        """
+        self._call({'op': 'set', 'session_id': session_id,
+                    'user_id': user_id,
+                    'created_at': created_at.timestamp(),
+                    'expires_at': _timestamp(expires_at)}, 'ok')
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """ Session of an id, or None if missing or expired
+        """
+        session = self._call({'op': 'get', 'session_id': session_id},
+                             'session')
+        if session is None:
+            return None
+        return {'user_id': session['user_id'],
+                'created_at': _datetime(session['created_at']),
+                'expires_at': _datetime(session.get('expires_at'))}
+
+    def delete(self, session_id: str) -> bool:
+        """ Delete a session, return False if there was none
+        """
+        return self._call({'op': 'delete', 'session_id': session_id},
+                          'deleted')
+
+    def session_ids(self) -> List[str]:
+        """ Ids of all the sessions of the server
+        """
+        return self._call({'op': 'ids'}, 'ids')
+
+    def sweep(self, now: datetime = None, limit: int = None) -> int:
+        """ Have the server delete up to limit sessions expired at now,
+        and return how many were
+        """
+        return self._call({'op': 'sweep', 'now': _timestamp(now),
+                           'limit': limit}, 'removed')
+
+    def stats(self) -> dict:
+        """ Number of sessions, and of sessions expired and evicted, of
+        the server
+        """
+        return self._call({'op': 'stats'}, 'stats')
+
+    def close(self):
+        """ Close the connection of the current thread
+        """
+        f = getattr(self._local, 'file', None)
+        if f is not None:
+            for resource in (f, self._local.sock):
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+            self._local.file = self._local.sock = None
+
+
+def handle_request(store: SessionStore, request: dict) -> dict:
+    """ Response of a store to a request of the socket protocol
+    """
+    op = request.get('op')
+    session_id = request.get('session_id')
+    if op == 'set':
+        store.set(session_id, request['user_id'],
+                  datetime.fromtimestamp(request['created_at']),
+                  _datetime(request.get('expires_at')))
+        return {'ok': True}
+    if op == 'get':
+        session = store.get(session_id)
+        if session is not None:
+            session['created_at'] = _timestamp(session['created_at'])
+            session['expires_at'] = _timestamp(session.get('expires_at'))
+        return {'session': session}
+    if op == 'delete':
+        return {'deleted': store.delete(session_id)}
+    if op == 'ids':
+        return {'ids': store.session_ids()}
+    if op == 'sweep':
+        return {'removed': store.sweep(_datetime(request.get('now')),
+                                       request.get('limit'))}
+    if op == 'stats':
+        return {'stats': store.stats()}
+    return {'error': "unknown op {}".format(op)}
+
+
+class SessionStoreServer(socketserver.ThreadingMixIn,
+                         socketserver.UnixStreamServer):
+    """ Server of a session store on a Unix socket
+    """
+    daemon_threads = True
+
+    def __init__(self, address: str, store: SessionStore):
+        """ Initialize a server of store, listening on address
+        """
+        if os.path.exists(address):
+            os.remove(address)
+        self.store = store
+        super().__init__(address, _SessionStoreHandler)
+
+
+class _SessionStoreHandler(socketserver.StreamRequestHandler):
+    """ Connection of a client to a SessionStoreServer
+    """
+
+    def handle(self):
+        """ Answer the requests of the client until it disconnects
+        """
+        for line in self.rfile:
+            try:
+                response = handle_request(self.server.store,
+                                          json.loads(line))
+            except (ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                response = {'error': "{}: {}".format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+def start_sweeper(store: SessionStore, interval: float
+                  ) -> threading.Thread:
+    """ Start a daemon thread sweeping the expired sessions of a store
+    every interval seconds
+    """
+    def sweep_loop():
+        """ Sweep until the process exits """
+        while True:
+            time.sleep(interval)
+            try:
+                store.sweep()
+            except Exception:
+                # Store unreachable for now: try again at the next round
+                pass
+
+    thread = threading.Thread(target=sweep_loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def get_session_store(kind: str = None, default: str = 'memory'
+                      ) -> SessionStore:
+    """ Session store of a kind, SESSION_STORE if not given, default if
+    not set
+    """
+    kind = kind or getenv('SESSION_STORE', default)
+    if kind == 'sqlite':
+        return SQLiteSessionStore(getenv('SESSION_STORE_PATH',
+                                         '.sessions.sqlite3'))
+    if kind == 'socket':
+        return SocketSessionStore(getenv('SESSION_STORE_PATH',
+                                         '.sessions.sock'))
+    if kind == 'memory':
+        return MemorySessionStore()
+    raise ValueError("unknown session store {}".format(kind))
+
+
+def main(argv: list) -> int:
+    """ Serve a session store on a Unix socket
+    """
+    parser = argparse.ArgumentParser(
+        prog="python3 -m api.v1.auth.session_store")
+    parser.add_argument("address", help="path of the Unix socket")
+    parser.add_argument("--sqlite", metavar="FILE",
+                        help="keep the sessions in a SQLite database "
+                             "instead of in memory")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS,
+                        help="evict the oldest sessions past this number "
+                             "(0: no limit)")
+    parser.add_argument("--sweep-interval", type=float, default=60,
+                        help="seconds between two sweeps of the expired "
+                             "sessions (0: only when clients ask)")
+    args = parser.parse_args(argv)
+    if args.sqlite:
+        store = SQLiteSessionStore(args.sqlite,
+                                   max_sessions=args.max_sessions)
+    else:
+        store = MemorySessionStore(args.max_sessions)
+    if args.sweep_interval > 0:
+        start_sweeper(store, args.sweep_interval)
+    with SessionStoreServer(args.address, store) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
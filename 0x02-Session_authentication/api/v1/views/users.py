@@ -2,27 +2,59 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, jsonify, request, Response
 from models.user import User
-from api.v1.auth.auth import Auth
+from os import getenv
+from typing import Optional
+import json
 
 
-auth = Auth()
+# Maximum number of items of a batch request
+BATCH_MAX_ITEMS = int(getenv('API_BATCH_MAX_ITEMS', 10000))
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): maximum number of users to return
+      - cursor (optional): next_cursor of the previous page
     Return:
-      - list of all User objects JSON represented
+      - without limit: list of all User objects JSON represented,
+        streamed in id order
+      - with limit: {"data": list of User objects JSON represented,
+        "next_cursor": cursor of the next page, null on the last one}
+      - 400 if limit is not a positive integer
     """
-    if auth.require_auth(request.path, []):
-        if auth.authorization_header(request) is None:
-            abort(401)  # Unauthorized
-        if auth.current_user(request) is None:
-            abort(403)  # Forbidden
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    if limit is None:
+        return Response(_stream_users(), mimetype='application/json')
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+    if limit <= 0:
+        return jsonify({'error': "limit must be a positive integer"}), 400
+    users, next_cursor = User.page(limit, request.args.get('cursor'))
+    return jsonify({'data': [user.to_json() for user in users],
+                    'next_cursor': next_cursor})
+
+
+def _stream_users(chunk_size: int = 100):
+    """ Generate the JSON list of all users, chunk_size users at a time
+    """
+    yield '['
+    separator = ''
+    chunk = []
+    for user in User.iter_all():
+        chunk.append(user.to_json_str())
+        if len(chunk) == chunk_size:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']\n'
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -36,15 +68,11 @@ def view_one_user(user_id: str = None) -> str:
     """
     if user_id is None:
         abort(404)
-    if auth.require_auth(request.path, []):
-        if auth.authorization_header(request) is None:
-            abort(401)  # Unauthorized
-        if auth.current_user(request) is None:
-            abort(403)  # Forbidden
     user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    return Response(user.to_json_str() + "\n",
+                    mimetype='application/json')
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -58,11 +86,6 @@ def delete_user(user_id: str = None) -> str:
     """
     if user_id is None:
         abort(404)
-    if auth.require_auth(request.path, []):
-        if auth.authorization_header(request) is None:
-            abort(401)  # Unauthorized
-        if auth.current_user(request) is None:
-            abort(403)  # Forbidden
     user = User.get(user_id)
     if user is None:
         abort(404)
@@ -82,11 +105,6 @@ def create_user() -> str:
       - User object JSON represented
       - 400 if can't create the new User
     """
-    if auth.require_auth(request.path, []):
-        if auth.authorization_header(request) is None:
-            abort(401)  # Unauthorized
-        if auth.current_user(request) is None:
-            abort(403)  # Forbidden
     rj = None
     error_msg = None
     try:
@@ -113,6 +131,108 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def batch_users() -> str:
+    """ POST /api/v1/users/batch
+    Body: JSON array, or NDJSON (Content-Type: application/x-ndjson), of
+    items:
+      - {"op": "create" (default), "email", "password", "first_name"
+        (optional), "last_name" (optional)}
+      - {"op": "update", "id", "first_name" (optional), "last_name"
+        (optional)}
+      - {"op": "delete", "id"}
+    All changes are saved, then removed, at once.
+    Return:
+      - results in the order of the items, in the format of the body:
+        {"status": 201 or 200, "user": User object JSON represented
+        (not on delete)} or {"status": 400 or 404, "error": message}
+      - 400 if the body isn't a list of items or has more than
+        BATCH_MAX_ITEMS items
+    """
+    items = _batch_items()
+    if items is None:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': "more than {} items".format(
+            BATCH_MAX_ITEMS)}), 400
+    results = [None] * len(items)
+    saves = []
+    removes = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {'status': 400, 'error': "Wrong format"}
+            continue
+        op = item.get('op', 'create')
+        if op == 'create':
+            if item.get("email", "") == "":
+                results[i] = {'status': 400, 'error': "email missing"}
+                continue
+            if item.get("password", "") == "":
+                results[i] = {'status': 400, 'error': "password missing"}
+                continue
+            user = User()
+            user.email = item.get("email")
+            user.password = item.get("password")
+            user.first_name = item.get("first_name")
+            user.last_name = item.get("last_name")
+            saves.append((i, user, 201))
+        elif op in ('update', 'delete'):
+            user = User.get(item.get('id'))
+            if user is None:
+                results[i] = {'status': 404, 'error': "Not found"}
+            elif op == 'delete':
+                removes.append((i, user))
+            else:
+                if item.get('first_name') is not None:
+                    user.first_name = item.get('first_name')
+                if item.get('last_name') is not None:
+                    user.last_name = item.get('last_name')
+                saves.append((i, user, 200))
+        else:
+            results[i] = {'status': 400,
+                          'error': "unknown op {}".format(op)}
+    errors = User.bulk_save([user for _, user, _ in saves])
+    for (i, user, status), error in zip(saves, errors):
+        if error is None:
+            results[i] = {'status': status, 'user': user.to_json()}
+        else:
+            results[i] = {'status': 400,
+                          'error': "Can't save User: {}".format(error)}
+    removed = User.bulk_remove([user for _, user in removes])
+    for (i, _), done in zip(removes, removed):
+        if done:
+            results[i] = {'status': 200}
+        else:
+            results[i] = {'status': 404, 'error': "Not found"}
+    if request.mimetype == 'application/x-ndjson':
+        return Response(''.join(json.dumps(result) + "\n"
+                                for result in results),
+                        mimetype='application/x-ndjson')
+    return jsonify(results), 200
+
+
+def _batch_items() -> Optional[list]:
+    """ Items of the body of a batch request, an item which isn't valid
+    JSON standing as None, or None if the body isn't a list of items
+    """
+    body = request.get_data(as_text=True)
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    try:
+        items = json.loads(body)
+    except ValueError:
+        return None
+    return items if isinstance(items, list) else None
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -128,11 +248,6 @@ def update_user(user_id: str = None) -> str:
     """
     if user_id is None:
         abort(404)
-    if auth.require_auth(request.path, []):
-        if auth.authorization_header(request) is None:
-            abort(401)  # Unauthorized
-        if auth.current_user(request) is None:
-            abort(403)  # Forbidden
     user = User.get(user_id)
     if user is None:
         abort(404)
@@ -160,4 +275,5 @@ def get_current_user() -> str:
     """
     if request.current_user is None:
         abort(404)
-    return jsonify(request.current_user.to_json())
+    return Response(request.current_user.to_json_str() + "\n",
+                    mimetype='application/json')
@@ -1,20 +1,251 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from typing import TypeVar, List, Iterable, Optional, Tuple
+from os import getenv, path
+from models.query import Query, match_value
+from models.snapshot import LazyObjects, write_snapshot
+from models.sqlite_storage import SQLiteStorage
+import atexit
+import contextlib
+import fcntl
+import glob
 import json
+import os
+import shutil
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+# "file" rewrites .db_<Class>.json on each change, "journal" appends the
+# change to .db_<Class>.journal and compacts it into the JSON snapshot,
+# "group" rewrites .db_<Class>.json once per group of changes
+PERSISTENCE = getenv('BASE_PERSISTENCE', 'file')
+JOURNAL_MAX_BYTES = int(getenv('BASE_JOURNAL_MAX_BYTES', 16 * 1024 * 1024))
+# Group commit: changes are flushed FLUSH_INTERVAL seconds after the first
+# one, or as soon as FLUSH_COUNT changes are pending
+FLUSH_INTERVAL = float(getenv('BASE_FLUSH_INTERVAL', 0.1))
+FLUSH_COUNT = int(getenv('BASE_FLUSH_COUNT', 1000))
+# "always" fsyncs every file write, "never" leaves it to the OS
+FSYNC = getenv('BASE_FSYNC', 'never')
+# "json" keeps the snapshot in .db_<Class>.json, "binary" in
+# .db_<Class>.snap, opened without parsing (see models.snapshot)
+SNAPSHOT_FORMAT = getenv('BASE_SNAPSHOT_FORMAT', 'json')
+# "json" keeps the objects in DATA, persisted as above, "sqlite" in the
+# SQLite database SQLITE_PATH, shared by all processes
+STORAGE = getenv('BASE_STORAGE', 'json')
+SQLITE_PATH = getenv('BASE_SQLITE_PATH', '.db.sqlite3')
+_sqlite = None
+# Class name -> open journal file
+JOURNALS = {}
+# Class names being compacted
+_COMPACTING = set()
+# Class name -> thread of its last background compaction
+_COMPACTIONS = {}
+_LOCK = threading.RLock()
+# Class name -> _FileLock serializing the writes of its files between
+# threads and processes, always taken before _LOCK: the files are written
+# without holding _LOCK
+_FILE_LOCKS = {}
+# Class -> number of changes waiting for the group commit
+_DIRTY = {}
+# Class name -> number of changes made / flushed to disk in group mode
+_CHANGES = {}
+_FLUSHED = {}
+# Class name -> ids of the objects changed since the last group commit
+_PENDING = {}
+_FLUSH_CONDITION = threading.Condition(_LOCK)
+_flusher = None
+# Class name -> indexed attribute -> value -> id of the object holding
+# it, or ids in a dict (to keep order) when several objects do
+INDEX_DATA = {}
+# Class name -> indexed attribute -> id -> value, as of the last save
+INDEXED_VALUES = {}
+# Index key of the objects whose value can't be hashed
+_UNHASHABLE = object()
+
+
+# Class -> (JSON key, attribute) pairs of its slots
+_SLOT_FIELDS = {}
+# Class name -> sorted ids, built on first use
+_SORTED_IDS = {}
+# The files are checked for changes made by other processes at most every
+# REFRESH_INTERVAL seconds (0: on every refresh)
+REFRESH_INTERVAL = float(getenv('BASE_REFRESH_INTERVAL', 0))
+# Class name -> class, of the loaded classes
+_CLASSES = {}
+# Class name -> generation, incremented whenever its objects change
+_GENERATIONS = {}
+# Class name -> [snapshot signature, journal inode, bytes of the journal
+# applied], as of the last check
+_FILE_STATE = {}
+# Class name -> time of the last check
+_CHECKED = {}
+
+
+def _sqlite_storage() -> Optional[SQLiteStorage]:
+    """ SQLite storage engine, or None if STORAGE isn't "sqlite"
+    """
+    global _sqlite
+    if STORAGE != 'sqlite':
+        return None
+    if _sqlite is None:
+        _sqlite = SQLiteStorage(SQLITE_PATH)
+    return _sqlite
+
+
+def _process_alive(pid: int) -> bool:
+    """ Check whether a process is running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _file_signature(file_path: str) -> Optional[tuple]:
+    """ (inode, size, modification time) of a file, or None if missing
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _index_ids(entry: object) -> dict:
+    """ Ids of an index entry, in a dict
+    """
+    if entry is None:
+        return {}
+    if type(entry) is dict:
+        return entry
+    return {entry: None}
+
+
+def _index_put(index: dict, key: object, obj_id: str):
+    """ Add an id to the entry of a value in an index
+    """
+    entry = index.get(key)
+    if entry is None:
+        index[key] = obj_id
+    elif type(entry) is dict:
+        entry[obj_id] = None
+    elif entry != obj_id:
+        index[key] = {entry: None, obj_id: None}
+
+
+def _index_drop(index: dict, key: object, obj_id: str):
+    """ Remove an id from the entry of a value in an index
+    """
+    entry = index.get(key)
+    if type(entry) is dict:
+        entry.pop(obj_id, None)
+        if len(entry) == 1:
+            index[key] = next(iter(entry))
+        elif not entry:
+            del index[key]
+    elif entry == obj_id:
+        del index[key]
+
+
+def _try_lock(file_path: str) -> Optional[int]:
+    """ Descriptor of a lock file locked with flock, or None if another
+    descriptor holds the lock; closing the descriptor releases it
+    """
+    fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class _FileLock():
+    """ Lock of the files of a class: reentrant between the threads of the
+    process, and an flock of a lock file between processes
+    """
+
+    def __init__(self, file_path: str):
+        """ Initialize a lock on a lock file, created when first locked
+        """
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def __enter__(self) -> '_FileLock':
+        """ Wait for the lock
+        """
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._pid != os.getpid():
+                    # A forked process shares the descriptor of its
+                    # parent, and so its flock: open its own
+                    self._fd = os.open(self.file_path,
+                                       os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *args: list):
+        """ Release the lock
+        """
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+
+def _timestamp(name: str) -> property:
+    """ Property of a timestamp stored in the slot _<name> as a datetime,
+    or as a string parsed on first access
+    """
+    slot = '_' + name
+
+    def getter(self) -> datetime:
+        value = getattr(self, slot, None)
+        if type(value) is str:
+            value = datetime.strptime(value, TIMESTAMP_FORMAT)
+            # Same timestamp: the cached JSON forms are still valid
+            object.__setattr__(self, slot, value)
+        return value
+
+    def setter(self, value: datetime):
+        setattr(self, slot, value)
+
+    return property(getter, setter)
 
 
 class Base():
     """ Base class
+
+    Attributes are kept in __slots__: a subclass declaring __slots__ for
+    its own attributes has no per-instance __dict__, one that doesn't
+    keeps working as a regular class.
     """
+    __slots__ = ('id', '_created_at', '_updated_at', '_json_cache')
+
+    # Indexed attributes: name -> True if values must be unique
+    INDEXES = {}
+
+    created_at = _timestamp('created_at')
+    updated_at = _timestamp('updated_at')
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
@@ -22,16 +253,16 @@ class Base():
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
+            self.__class__.rebuild_indexes()
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
+        # Timestamps given as strings are parsed on first access
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = kwargs.get('created_at')
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = kwargs.get('updated_at')
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,11 +275,87 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _slot_fields(cls) -> tuple:
+        """ (JSON key, attribute) pairs of the slots of the class, in
+        declaration order from Base down
+        """
+        fields = _SLOT_FIELDS.get(cls)
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for slot in klass.__dict__.get('__slots__', ()):
+                    if slot in ('__dict__', '__weakref__', '_json_cache'):
+                        continue
+                    key = slot
+                    if klass is Base and slot in ('_created_at',
+                                                  '_updated_at'):
+                        key = slot[1:]
+                    fields.append((key, slot))
+            fields = _SLOT_FIELDS[cls] = tuple(fields)
+        return fields
+
+    def __setattr__(self, name: str, value: object):
+        """ Set an attribute, dropping the cached JSON forms
+        """
+        object.__setattr__(self, name, value)
+        if name != '_json_cache':
+            object.__setattr__(self, '_json_cache', None)
+
+    def _cache(self) -> dict:
+        """ Cache of the JSON forms served by the API, emptied by any
+        attribute write
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            # Set before reading the attributes: a concurrent write
+            # detaches it instead of leaving stale entries behind
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
+
+        Only the view form is cached: the serialization form is built
+        for each write of the files, and would stay on every object
+        """
+        if for_serialization:
+            return self._build_json(True)
+        cache = self._cache()
+        result = cache.get(False)
+        if result is None:
+            result = cache[False] = self._build_json(False)
+        return dict(result)
+
+    def to_json_str(self) -> str:
+        """ JSON document of the object, encoded as jsonify does (sorted
+        keys, no spaces) without its final newline
+        """
+        cache = self._cache()
+        result = cache.get('str')
+        if result is None:
+            # The dictionary is reused if cached, not cached for this
+            obj_json = cache.get(False)
+            if obj_json is None:
+                obj_json = self._build_json(False)
+            result = cache['str'] = json.dumps(
+                obj_json, sort_keys=True, separators=(',', ':'))
+        return result
+
+    def _build_json(self, for_serialization: bool) -> dict:
+        """ Convert the object a JSON dictionary, without the cache
         """
         result = {}
-        for key, value in self.__dict__.items():
+        items = []
+        for key, attr in self.__class__._slot_fields():
+            try:
+                items.append((key, getattr(self, attr)))
+            except AttributeError:
+                continue
+        if hasattr(self, '__dict__'):
+            items.extend(self.__dict__.items())
+        for key, value in items:
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,55 +364,796 @@ class Base():
                 result[key] = value
         return result
 
+    @classmethod
+    def _file_path(cls, extension: str = "json") -> str:
+        """ Path of a storage file of the class
+        """
+        return ".db_{}.{}".format(cls.__name__, extension)
+
+    @classmethod
+    def _snapshot_path(cls) -> str:
+        """ Path of the snapshot file of the class
+        """
+        return cls._file_path("snap" if SNAPSHOT_FORMAT == 'binary'
+                              else "json")
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
+
+        The snapshot is loaded first, then the changes logged in the
+        journal since the last compaction are replayed. Objects of a
+        binary snapshot are only built when first accessed.
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        file_path = cls._file_path()
+        storage = _sqlite_storage()
+        if storage is not None:
+            # The objects stay in the database: a JSON file is only
+            # imported into a new table
+            if path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    storage.import_objects(cls, json.load(f))
+            storage.table(cls)
             return
+        with cls._file_lock(), _LOCK:
+            _CLASSES[s_class] = cls
+            cls._remove_stale_files()
+            snapshot = _file_signature(cls._snapshot_path())
+            cls._load_snapshot()
+            cls._replay_journal(cls._file_path("journal.old"))
+            journal, offset, _ = cls._replay_journal(
+                cls._file_path("journal"))
+            _FILE_STATE[s_class] = [snapshot, journal, offset]
+            cls._bump_generation()
+
+    @classmethod
+    def _remove_stale_files(cls):
+        """ Remove the temporary files of the class left by writers which
+        died before renaming them
+        """
+        threads = {thread.ident for thread in threading.enumerate()}
+        for tmp_path in glob.glob(glob.escape(cls._file_path("")) + "*.tmp"):
+            try:
+                pid, tid = map(int, tmp_path.rsplit('.', 3)[1:3])
+            except ValueError:
+                continue
+            if pid == os.getpid():
+                stale = tid not in threads
+            else:
+                stale = not _process_alive(pid)
+            if stale:
+                try:
+                    os.remove(tmp_path)
+                except FileNotFoundError:
+                    pass
+
+    @classmethod
+    def _load_snapshot(cls):
+        """ Replace the objects in memory with those of the snapshot
+        """
+        s_class = cls.__name__
+        file_path = cls._file_path()
+        snapshot_path = cls._file_path("snap")
+        DATA[s_class] = {}
+        _SORTED_IDS.pop(s_class, None)
+        if SNAPSHOT_FORMAT == 'binary' and path.exists(snapshot_path):
+            objs = LazyObjects(snapshot_path, lambda obj_json: cls(
+                **obj_json))
+            DATA[s_class] = objs
+            indexed = {attr: values for attr, values in objs.indexed.items()
+                       if attr in cls.INDEXES}
+            missing = [attr for attr in cls.INDEXES if attr not in indexed]
+            if missing:
+                # Snapshot converted without these indexes: their values
+                # are read from the records, still without building the
+                # objects
+                indexed.update({attr: {} for attr in missing})
+                for obj_id, record in objs.entries():
+                    obj_json = record.load_json()
+                    for attr in missing:
+                        indexed[attr][obj_id] = obj_json.get(attr)
+            cls._load_indexes(indexed)
+        else:
+            if path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+                    for obj_id, obj_json in objs_json.items():
+                        DATA[s_class][obj_id] = cls(**obj_json)
+            cls.rebuild_indexes()
+
+    @classmethod
+    def _reload_snapshot(cls, keep: Iterable[str] = ()) -> bool:
+        """ Apply the differences between the snapshot file and the
+        objects in memory, except to the ids of keep (changes not written
+        yet), and return whether any object changed
+
+        A binary snapshot is simply opened again, as that only reads its
+        header.
+        """
+        s_class = cls.__name__
+        keep = set(keep)
+        if SNAPSHOT_FORMAT == 'binary':
+            kept = {obj_id: DATA[s_class].get(obj_id) for obj_id in keep}
+            cls._load_snapshot()
+            for obj_id, obj in kept.items():
+                cls._set_object(obj_id, obj)
+            return True
+        file_path = cls._file_path()
+        objs_json = {}
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+        changed = False
+        for obj_id in [obj_id for obj_id in DATA[s_class]
+                       if obj_id not in objs_json and obj_id not in keep]:
+            changed |= cls._set_object(obj_id, None)
+        for obj_id, obj_json in objs_json.items():
+            if obj_id not in keep:
+                changed |= cls._apply_change({'op': 'save', 'id': obj_id,
+                                              'obj': obj_json})
+        return changed
+
+    @classmethod
+    def _replay_journal(cls, journal_path: str, offset: int = 0
+                        ) -> Tuple[Optional[int], int, bool]:
+        """ Apply the changes logged in a journal file from a byte offset
+
+        Return the inode of the journal (None if missing), the offset
+        after its last complete line, and whether any object changed
+        """
+        try:
+            f = open(journal_path, 'rb')
+        except FileNotFoundError:
+            return None, 0, False
+        changed = False
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written, or cut by a crash
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Line cut by a crash, then appended to
+                    continue
+                changed |= cls._apply_change(entry)
+        return inode, offset, changed
+
+    @classmethod
+    def _apply_change(cls, entry: dict) -> bool:
+        """ Apply a change logged as a journal entry, and return False if
+        the objects already reflected it
+        """
+        obj_id = entry.get('id')
+        if entry.get('op') == 'remove':
+            return cls._set_object(obj_id, None)
+        objs = DATA[cls.__name__]
+        if obj_id in objs and objs[obj_id].to_json(True) == entry['obj']:
+            return False
+        return cls._set_object(obj_id, cls(**entry['obj']))
+
+    @classmethod
+    def _set_object(cls, obj_id: str, obj: Optional['Base']) -> bool:
+        """ Put an object in memory, or remove its id if obj is None,
+        keeping the indexes and the sorted ids up to date, and return
+        False if there was nothing to remove
+        """
+        s_class = cls.__name__
+        objs = DATA[s_class]
+        sorted_ids = _SORTED_IDS.get(s_class)
+        if obj is None:
+            if obj_id not in objs:
+                return False
+            del objs[obj_id]
+            cls._unindex(obj_id)
+            if sorted_ids is not None:
+                del sorted_ids[bisect_left(sorted_ids, obj_id)]
+            return True
+        if sorted_ids is not None and obj_id not in objs:
+            insort(sorted_ids, obj_id)
+        objs[obj_id] = obj
+        obj._index_update()
+        return True
+
+    @classmethod
+    def refresh(cls, force: bool = False) -> int:
+        """ Apply the changes other processes made to the files of the
+        class since the last check, and return its generation
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        A check costs a stat of the snapshot and of the journal, and is
+        done at most every REFRESH_INTERVAL seconds unless forced. Only
+        the changed objects are rebuilt: the journal is read from where
+        the last check stopped, and a rewritten JSON snapshot is compared
+        with the objects in memory.
+        """
+        s_class = cls.__name__
+        if _sqlite_storage() is not None:
+            return cls.generation()
+        now = time.monotonic()
+        with _LOCK:
+            state = _FILE_STATE.get(s_class)
+            if state is None or (not force and s_class in _CHECKED and
+                                 now - _CHECKED[s_class] < REFRESH_INTERVAL):
+                return cls.generation()
+            _CHECKED[s_class] = now
+            snapshot = _file_signature(cls._snapshot_path())
+            journal = _file_signature(cls._file_path("journal"))
+            journal_inode = None if journal is None else journal[0]
+            if snapshot == state[0] and journal_inode == state[1] and \
+                    (journal is None or journal[1] == state[2]):
+                return cls.generation()
+            changed = False
+            offset = state[2]
+            if snapshot != state[0] or journal_inode != state[1]:
+                if snapshot != state[0]:
+                    # Changes waiting for the group commit are kept: it
+                    # writes them over the merged snapshot
+                    changed |= cls._reload_snapshot(
+                        _PENDING.get(s_class, ()))
+                if journal_inode != state[1]:
+                    # Another process compacted the journal: ours was set
+                    # aside
+                    cls._close_journal()
+                changed |= cls._replay_journal(
+                    cls._file_path("journal.old"))[2]
+                offset = 0
+            journal_inode, offset, journal_changed = cls._replay_journal(
+                cls._file_path("journal"), offset)
+            _FILE_STATE[s_class] = [snapshot, journal_inode, offset]
+            if changed or journal_changed:
+                cls._bump_generation()
+            return cls.generation()
+
+    @classmethod
+    def generation(cls) -> int:
+        """ Generation of the objects of the class, which changes whenever
+        one of them does, to validate what is cached from them
+        """
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.generation(cls)
+        return _GENERATIONS.get(cls.__name__, 0)
+
+    @classmethod
+    def _bump_generation(cls):
+        """ Record a change of the objects of the class
+        """
+        s_class = cls.__name__
+        _GENERATIONS[s_class] = _GENERATIONS.get(s_class, 0) + 1
+
+    @classmethod
+    def _snapshot_entries(cls) -> list:
+        """ (id, object) pairs of the class, an object of a binary snapshot
+        not built yet standing as its Pending record
+        """
+        objs = DATA[cls.__name__]
+        if isinstance(objs, LazyObjects):
+            return objs.entries()
+        return list(objs.items())
+
+    @staticmethod
+    def _entries_json(entries: list) -> dict:
+        """ JSON dictionaries by id of (id, object) pairs
+        """
+        return {obj_id: obj.to_json(True) if isinstance(obj, Base)
+                else obj.load_json() for obj_id, obj in entries}
+
+    @classmethod
+    def _write_temporary(cls, objs_json: dict) -> str:
+        """ Write objects to a temporary file named after the snapshot,
+        the process and the thread, and return its path
+        """
+        tmp_path = "{}.{}.{}.tmp".format(cls._snapshot_path(), os.getpid(),
+                                         threading.get_ident())
+        try:
+            with open(tmp_path, 'wb' if SNAPSHOT_FORMAT == 'binary'
+                      else 'w') as f:
+                if SNAPSHOT_FORMAT == 'binary':
+                    write_snapshot(f, objs_json, cls.INDEXES)
+                else:
+                    json.dump(objs_json, f)
+                if FSYNC == 'always':
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    @classmethod
+    def _install_snapshot(cls, tmp_path: str) -> tuple:
+        """ Rename a temporary file to the snapshot file, and return the
+        signature of the snapshot
+        """
+        file_path = cls._snapshot_path()
+        signature = _file_signature(tmp_path)
+        os.replace(tmp_path, file_path)
+        if FSYNC == 'always':
+            dir_fd = os.open(path.dirname(path.abspath(file_path)),
+                             os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        return signature
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
+        if _sqlite_storage() is not None:
+            # Every change is already committed to the database
+            return
+        with cls._file_lock():
+            # The snapshot replaces the files other processes wrote:
+            # catch up with them first
+            cls.refresh(force=True)
+            # Only the JSON is collected under _LOCK: readers don't wait
+            # for the file to be written
+            with _LOCK:
+                objs_json = cls._entries_json(cls._snapshot_entries())
+            tmp_path = cls._write_temporary(objs_json)
+            with _LOCK:
+                # Renamed with the state updated, so a refresh meanwhile
+                # doesn't take it for the snapshot of another process
+                signature = cls._install_snapshot(tmp_path)
+                # The snapshot now holds every logged change
+                cls._close_journal()
+                for extension in ("journal.old", "journal"):
+                    if path.exists(cls._file_path(extension)):
+                        os.remove(cls._file_path(extension))
+                if s_class in _FILE_STATE:
+                    _FILE_STATE[s_class] = [signature, None, 0]
+
+    @classmethod
+    def _file_lock(cls) -> _FileLock:
+        """ Lock serializing the writes of the files of the class between
+        threads and processes, held from reading the files to renaming
+        the snapshot or appending to the journal
+        """
+        lock = _FILE_LOCKS.get(cls.__name__)
+        if lock is None:
+            lock = _FILE_LOCKS.setdefault(
+                cls.__name__, _FileLock(cls._file_path("lock")))
+        return lock
+
+    @classmethod
+    def _change_lock(cls):
+        """ Lock to take, before _LOCK, around a change of the objects:
+        the file lock unless the change is only written by the group
+        commit
+        """
+        if PERSISTENCE == 'group':
+            return contextlib.nullcontext()
+        return cls._file_lock()
+
+    @classmethod
+    def _close_journal(cls):
+        """ Close the journal file of the class if open
+        """
+        f = JOURNALS.pop(cls.__name__, None)
+        if f is not None:
+            f.close()
+
+    @classmethod
+    def _journal_append(cls, entries: List[dict]):
+        """ Log changes to the journal in a single write, starting a
+        compaction in the background once the journal is larger than
+        JOURNAL_MAX_BYTES
+        """
+        s_class = cls.__name__
+        journal_path = cls._file_path("journal")
+        with cls._file_lock(), _LOCK:
+            f = JOURNALS.get(s_class)
+            journal = _file_signature(journal_path)
+            if f is not None and (journal is None or
+                                  os.fstat(f.fileno()).st_ino != journal[0]):
+                # Set aside by a compaction: log to the new journal
+                cls._close_journal()
+                f = None
+            if f is None:
+                f = JOURNALS[s_class] = open(journal_path, 'a')
+            start = os.fstat(f.fileno()).st_size
+            f.write(''.join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            if FSYNC == 'always':
+                os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+            state = _FILE_STATE.get(s_class)
+            if state is not None and state[1] == st.st_ino and \
+                    state[2] == start:
+                # Already applied here: the next refresh skips them
+                state[2] = st.st_size
+            if st.st_size > JOURNAL_MAX_BYTES:
+                cls.compact(background=True)
+
+    @classmethod
+    def compact(cls, background: bool = False):
+        """ Fold the journal into the snapshot
+
+        The journal is set aside as .journal.old, so changes keep being
+        logged to a new journal while the snapshot is rebuilt. As every
+        process logs to the journal, the snapshot is rebuilt from the
+        files, not from the objects in memory, and a lock file lets a
+        single process compact at a time.
+        """
+        s_class = cls.__name__
+        with _LOCK:
+            if s_class in _COMPACTING:
+                return
+            lock_fd = _try_lock(cls._file_path("compact.lock"))
+            if lock_fd is None:
+                # Another process is compacting
+                return
+            _COMPACTING.add(s_class)
+
+        def _compact():
+            """ Rebuild the snapshot and drop the old journal """
+            tmp_path = None
+            try:
+                cls._set_journal_aside()
+                objs_json, signature = cls._fold_journal()
+                tmp_path = cls._write_temporary(objs_json)
+                with cls._file_lock():
+                    # Else save_to_file wrote every change meanwhile
+                    if _file_signature(cls._snapshot_path()) == signature:
+                        cls._install_snapshot(tmp_path)
+                        tmp_path = None
+                        old_path = cls._file_path("journal.old")
+                        if path.exists(old_path):
+                            os.remove(old_path)
+            finally:
+                if tmp_path is not None:
+                    os.remove(tmp_path)
+                os.close(lock_fd)
+                with _LOCK:
+                    _COMPACTING.discard(s_class)
+
+        if background:
+            # Joined at exit, so the snapshot is never left half-written
+            thread = threading.Thread(target=_compact, daemon=True)
+            _COMPACTIONS[s_class] = thread
+            thread.start()
+        else:
+            _compact()
+
+    @classmethod
+    def _set_journal_aside(cls):
+        """ Rename the journal to .journal.old, or append it to the old
+        journal left by a compaction which did not finish
+        """
+        journal_path = cls._file_path("journal")
+        old_path = cls._file_path("journal.old")
+        with cls._file_lock(), _LOCK:
+            cls._close_journal()
+            if not path.exists(journal_path):
+                return
+            if path.exists(old_path):
+                with open(journal_path, 'r') as src, \
+                        open(old_path, 'a') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(journal_path)
+            else:
+                os.replace(journal_path, old_path)
+
+    @classmethod
+    def _fold_journal(cls) -> Tuple[dict, Optional[tuple]]:
+        """ JSON dictionaries by id of the snapshot file with the changes
+        of the old journal applied, and the signature of the snapshot
+        """
+        snapshot_path = cls._snapshot_path()
+        signature = _file_signature(snapshot_path)
         objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        if SNAPSHOT_FORMAT == 'binary' and signature is not None:
+            objs_json = {obj_id: record.load_json() for obj_id, record in
+                         LazyObjects(snapshot_path, dict).entries()}
+        elif path.exists(cls._file_path()):
+            with open(cls._file_path(), 'r') as f:
+                objs_json = json.load(f)
+        try:
+            f = open(cls._file_path("journal.old"), 'rb')
+        except FileNotFoundError:
+            return objs_json, signature
+        with f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Cut by a crash
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('op') == 'remove':
+                    objs_json.pop(entry.get('id'), None)
+                else:
+                    objs_json[entry['id']] = entry['obj']
+        return objs_json, signature
+
+    @classmethod
+    def _persist(cls, op: str, objs: List[TypeVar('Base')]):
+        """ Persist the same change of objects according to PERSISTENCE
+
+        Called under the change lock, and under _LOCK only in group mode,
+        where it just queues the objects for the next flush
+        """
+        if PERSISTENCE == 'journal':
+            entries = []
+            for obj in objs:
+                entry = {'op': op, 'id': obj.id}
+                if op == 'save':
+                    entry['obj'] = obj.to_json(True)
+                entries.append(entry)
+            cls._journal_append(entries)
+        elif PERSISTENCE == 'group':
+            cls._mark_dirty([obj.id for obj in objs])
+        else:
+            cls.save_to_file()
+
+    @classmethod
+    def _mark_dirty(cls, obj_ids: List[str]):
+        """ Queue a rewrite of the file for the group commit of changed
+        objects
+        """
+        global _flusher
+        s_class = cls.__name__
+        with _FLUSH_CONDITION:
+            _CHANGES[s_class] = _CHANGES.get(s_class, 0) + 1
+            _DIRTY[cls] = _DIRTY.get(cls, 0) + len(obj_ids)
+            _PENDING.setdefault(s_class, set()).update(obj_ids)
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, daemon=True)
+                _flusher.start()
+                atexit.register(flush_all)
+            _FLUSH_CONDITION.notify_all()
+
+    @classmethod
+    def flush(cls):
+        """ Write the pending group commit of the class now
+        """
+        s_class = cls.__name__
+        with cls._file_lock():
+            with _FLUSH_CONDITION:
+                if _DIRTY.pop(cls, None) is None:
+                    return
+                changes = _CHANGES.get(s_class, 0)
+                # Merge the snapshots other processes wrote: the changes
+                # of this one are kept, then written with theirs
+                cls.refresh(force=True)
+                _PENDING.pop(s_class, None)
+            cls.save_to_file()
+            with _FLUSH_CONDITION:
+                _FLUSHED[s_class] = max(_FLUSHED.get(s_class, 0), changes)
+                _FLUSH_CONDITION.notify_all()
+
+    @classmethod
+    def wait_durable(cls, timeout: float = None) -> bool:
+        """ Wait until the changes made so far to the class are written
+        to disk, and return False if it took longer than timeout
+        """
+        s_class = cls.__name__
+        with _FLUSH_CONDITION:
+            changes = _CHANGES.get(s_class, 0)
+            return _FLUSH_CONDITION.wait_for(
+                lambda: _FLUSHED.get(s_class, 0) >= changes, timeout)
+
+    @classmethod
+    def rebuild_indexes(cls):
+        """ Rebuild the indexes from all objects
+        """
+        s_class = cls.__name__
+        INDEX_DATA[s_class] = {attr: {} for attr in cls.INDEXES}
+        INDEXED_VALUES[s_class] = {attr: {} for attr in cls.INDEXES}
+        for obj in DATA.get(s_class, {}).values():
+            obj._index_add()
+
+    @classmethod
+    def _load_indexes(cls, indexed: dict):
+        """ Build the indexes from the indexed values of a snapshot, by
+        attribute then id, without building the objects
+        """
+        s_class = cls.__name__
+        INDEX_DATA[s_class] = {attr: {} for attr in cls.INDEXES}
+        INDEXED_VALUES[s_class] = {attr: {} for attr in cls.INDEXES}
+        for attr, values in indexed.items():
+            index = INDEX_DATA[s_class][attr]
+            saved = INDEXED_VALUES[s_class][attr]
+            for obj_id, value in values.items():
+                key = cls._index_key(value)
+                _index_put(index, key, obj_id)
+                saved[obj_id] = key
+
+    @staticmethod
+    def _index_key(value) -> object:
+        """ Key of a value in an index
+        """
+        try:
+            hash(value)
+        except TypeError:
+            return _UNHASHABLE
+        return value
+
+    def _index_check(self):
+        """ Raise ValueError if saving would break a unique index
+
+        A value saved before is accepted as is: stores written before the
+        index existed may hold duplicates.
+        """
+        s_class = self.__class__.__name__
+        indexes = INDEX_DATA[s_class]
+        saved = INDEXED_VALUES[s_class]
+        for attr, unique in self.__class__.INDEXES.items():
+            if not unique:
+                continue
+            key = self._index_key(getattr(self, attr, None))
+            if key is None or key is _UNHASHABLE:
+                continue
+            if saved[attr].get(self.id) == key:
+                continue
+            for obj_id in _index_ids(indexes[attr].get(key)):
+                if obj_id != self.id:
+                    raise ValueError("{} {} already exists".format(
+                        attr, getattr(self, attr)))
+
+    def _index_add(self):
+        """ Add current object to the indexes
+        """
+        s_class = self.__class__.__name__
+        for attr in self.__class__.INDEXES:
+            key = self._index_key(getattr(self, attr, None))
+            _index_put(INDEX_DATA[s_class][attr], key, self.id)
+            INDEXED_VALUES[s_class][attr][self.id] = key
+
+    @classmethod
+    def _unindex(cls, obj_id: str):
+        """ Remove an object from the indexes by id
+        """
+        s_class = cls.__name__
+        for attr, saved in INDEXED_VALUES[s_class].items():
+            if obj_id in saved:
+                _index_drop(INDEX_DATA[s_class][attr], saved.pop(obj_id),
+                            obj_id)
+
+    def _index_remove(self):
+        """ Remove current object from the indexes
+        """
+        self.__class__._unindex(self.id)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    def _index_update(self):
+        """ Update the indexes after a change of current object
+        """
+        s_class = self.__class__.__name__
+        if all(self.id in saved and
+               saved[self.id] == self._index_key(getattr(self, attr, None))
+               for attr, saved in INDEXED_VALUES[s_class].items()):
+            return
+        self._index_remove()
+        self._index_add()
 
     def save(self):
         """ Save current object
+
+        Raises ValueError if it would break a unique index
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        error = self.__class__.bulk_save([self])[0]
+        if error is not None:
+            raise error
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        self.__class__.bulk_remove([self])
+
+    @classmethod
+    def bulk_save(cls, objs: Iterable[TypeVar('Base')]
+                  ) -> List[Optional[ValueError]]:
+        """ Save objects under one lock, and persist them at once
+
+        Return, for each object, None if it was saved or the ValueError
+        of the unique index it would break (then it is skipped)
+        """
+        objs = list(objs)
+        now = datetime.utcnow()
+        storage = _sqlite_storage()
+        if storage is not None:
+            for obj in objs:
+                obj.updated_at = now
+            return storage.save_each(objs)
+        s_class = cls.__name__
+        errors = []
+        saved = []
+        new_ids = []
+        with cls._change_lock():
+            with _LOCK:
+                if PERSISTENCE != 'group':
+                    # Catch up with the other processes, under the file lock
+                    # until the change is written: the snapshot is rewritten
+                    # from the objects in memory, and the unique indexes
+                    # must see their objects
+                    cls.refresh(force=True)
+                for obj in objs:
+                    try:
+                        obj._index_check()
+                    except ValueError as e:
+                        errors.append(e)
+                        continue
+                    obj.updated_at = now
+                    if obj.id not in DATA[s_class]:
+                        new_ids.append(obj.id)
+                    DATA[s_class][obj.id] = obj
+                    obj._index_update()
+                    saved.append(obj)
+                    errors.append(None)
+                sorted_ids = _SORTED_IDS.get(s_class)
+                if sorted_ids is not None and len(new_ids) == 1:
+                    insort(sorted_ids, new_ids[0])
+                elif sorted_ids is not None and new_ids:
+                    # Merges the two sorted runs in linear time
+                    sorted_ids.extend(sorted(new_ids))
+                    sorted_ids.sort()
+                if saved:
+                    cls._bump_generation()
+                    if PERSISTENCE == 'group':
+                        # Pending before a flush can merge over them
+                        cls._persist('save', saved)
+            if saved and PERSISTENCE != 'group':
+                # Written after releasing _LOCK: readers don't wait
+                cls._persist('save', saved)
+        return errors
+
+    @classmethod
+    def bulk_remove(cls, objs: Iterable[TypeVar('Base')]) -> List[bool]:
+        """ Remove objects under one lock, and persist it at once
+
+        Return, for each object, whether it was removed (False if it
+        didn't exist)
+        """
+        objs = list(objs)
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.remove_many(cls, [obj.id for obj in objs])
+        s_class = cls.__name__
+        results = []
+        removed = []
+        with cls._change_lock():
+            with _LOCK:
+                if PERSISTENCE != 'group':
+                    cls.refresh(force=True)
+                for obj in objs:
+                    if DATA[s_class].get(obj.id) is None:
+                        results.append(False)
+                        continue
+                    del DATA[s_class][obj.id]
+                    cls._unindex(obj.id)
+                    removed.append(obj)
+                    results.append(True)
+                sorted_ids = _SORTED_IDS.get(s_class)
+                if sorted_ids is not None and len(removed) == 1:
+                    del sorted_ids[bisect_left(sorted_ids, removed[0].id)]
+                elif sorted_ids is not None and removed:
+                    ids = {obj.id for obj in removed}
+                    sorted_ids[:] = [obj_id for obj_id in sorted_ids
+                                     if obj_id not in ids]
+                if removed:
+                    cls._bump_generation()
+                    if PERSISTENCE == 'group':
+                        cls._persist('remove', removed)
+            if removed and PERSISTENCE != 'group':
+                cls._persist('remove', removed)
+        return results
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.count(cls)
         return len(DATA[s_class].keys())
 
     @classmethod
@@ -114,18 +1162,100 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def sorted_ids(cls) -> List[str]:
+        """ Ids of all objects in ascending order, kept up to date by
+        save and remove once built
+        """
+        s_class = cls.__name__
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.sorted_ids(cls)
+        with _LOCK:
+            sorted_ids = _SORTED_IDS.get(s_class)
+            if sorted_ids is None:
+                sorted_ids = _SORTED_IDS[s_class] = sorted(DATA[s_class])
+            return sorted_ids
+
+    @classmethod
+    def page(cls, limit: int, cursor: str = None
+             ) -> Tuple[List[TypeVar('Base')], Optional[str]]:
+        """ Return up to limit objects in id order, starting after the id
+        cursor, and the cursor of the next page (None on the last page)
+        """
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.page(cls, limit, cursor)
+        with _LOCK:
+            sorted_ids = cls.sorted_ids()
+            start = 0 if cursor is None else bisect_right(sorted_ids, cursor)
+            ids = sorted_ids[start:start + limit]
+            more = start + limit < len(sorted_ids)
+        objs = [obj for obj in map(cls.get, ids) if obj is not None]
+        return objs, (ids[-1] if more and ids else None)
+
+    @classmethod
+    def iter_all(cls) -> Iterable[TypeVar('Base')]:
+        """ Iterate over all objects in id order, without building a list
+        of the objects
+        """
+        storage = _sqlite_storage()
+        if storage is not None:
+            yield from storage.iter_all(cls)
+            return
+        with _LOCK:
+            ids = list(cls.sorted_ids())
+        for obj_id in ids:
+            obj = cls.get(obj_id)
+            if obj is not None:
+                yield obj
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
         s_class = cls.__name__
+        storage = _sqlite_storage()
+        if storage is not None:
+            return storage.get(cls, id)
         return DATA[s_class].get(id)
 
+    @classmethod
+    def _indexed_ids(cls, attributes: dict) -> Optional[Iterable[str]]:
+        """ Ids of the candidate objects for a search, from the smallest
+        matching index entry, or None if no searched attribute is indexed
+        """
+        indexes = INDEX_DATA.get(cls.__name__)
+        if not indexes:
+            return None
+        best = None
+        for k, v in attributes.items():
+            index = indexes.get(k)
+            if index is None:
+                continue
+            key = cls._index_key(v)
+            if key is _UNHASHABLE:
+                continue
+            ids = _index_ids(index.get(key))
+            unhashable = index.get(_UNHASHABLE)
+            if unhashable is not None:
+                ids = {**ids, **_index_ids(unhashable)}
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
     @classmethod
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Indexed attributes are looked up in their index instead of
+        scanning all objects.
         """
         s_class = cls.__name__
+        storage = _sqlite_storage()
+        if storage is not None:
+            return list(storage.search(cls, attributes))
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -133,5 +1263,158 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        objs = DATA[s_class]
+        ids = cls._indexed_ids(attributes)
+        if ids is None:
+            return list(filter(_search, objs.values()))
+        candidates = (objs.get(obj_id) for obj_id in ids)
+        return [obj for obj in candidates
+                if obj is not None and _search(obj)]
+
+    @classmethod
+    def query(cls) -> Query:
+        """ Query on all objects, see models.query
+        """
+        return Query(cls)
+
+    @classmethod
+    def _index_lookup(cls, attr: str, op: str, value: object
+                      ) -> Optional[Tuple[dict, bool]]:
+        """ Ids of the objects matching a condition according to the
+        index of its attribute, and whether the index decides it alone,
+        or None if the attribute isn't indexed
+
+        Prefix and range conditions scan the distinct indexed values,
+        not the objects.
+        """
+        index = INDEX_DATA.get(cls.__name__, {}).get(attr)
+        if index is None:
+            return None
+        if op == 'eq' or op == 'in':
+            keys = [cls._index_key(v) for v in
+                    (value if op == 'in' else (value,))]
+            if any(key is _UNHASHABLE for key in keys):
+                return None
+            ids = {}
+            for key in keys:
+                ids.update(_index_ids(index.get(key)))
+        else:
+            ids = {}
+            for key, entry in index.items():
+                if key is not _UNHASHABLE and match_value(op, key, value):
+                    ids.update(_index_ids(entry))
+        unhashable = index.get(_UNHASHABLE)
+        if unhashable is not None:
+            return {**ids, **_index_ids(unhashable)}, False
+        return ids, True
+
+    @classmethod
+    def _query_ids(cls, predicates: Iterable[tuple]
+                   ) -> Tuple[Optional[List[str]], bool]:
+        """ Ids of the candidate objects of a query, intersected over its
+        indexed conditions (None if it has none), and whether the indexes
+        decide every condition
+        """
+        best = None
+        exact = True
+        with _LOCK:
+            for attr, op, value in predicates:
+                found = cls._index_lookup(attr, op, value)
+                if found is None:
+                    exact = False
+                    continue
+                ids, decided = found
+                exact = exact and decided
+                if best is None:
+                    best = ids
+                else:
+                    small, large = sorted((best, ids), key=len)
+                    best = {obj_id: None for obj_id in small
+                            if obj_id in large}
+        if best is None:
+            return None, False
+        return list(best), exact
+
+    @classmethod
+    def _run_query(cls, query: Query) -> Iterable[TypeVar('Base')]:
+        """ Iterate over the objects matching a query, in order
+        """
+        storage = _sqlite_storage()
+        if storage is not None:
+            objs, done = storage.query(cls, query)
+            if done:
+                return objs
+            return query.arrange(filter(query.matches, objs),
+                                 ordered=storage.can_order(cls, query))
+        ids, _ = cls._query_ids(query.predicates)
+        by_id = query.order_attr == 'id'
+        if ids is None:
+            with _LOCK:
+                ids = list(cls.sorted_ids() if by_id else DATA[cls.__name__])
+        elif by_id:
+            ids.sort()
+        if by_id and query.descending:
+            ids.reverse()
+        objs = (obj for obj in map(cls.get, ids)
+                if obj is not None and query.matches(obj))
+        return query.arrange(objs, ordered=by_id)
+
+    @classmethod
+    def _count_query(cls, query: Query) -> int:
+        """ Number of objects matching a query, without building them when
+        the indexes decide every condition
+        """
+        storage = _sqlite_storage()
+        if storage is not None:
+            total = storage.count_query(cls, query)
+        elif not query.predicates:
+            total = cls.count()
+        else:
+            ids, exact = cls._query_ids(query.predicates)
+            total = len(ids) if exact else None
+        if total is None:
+            total = sum(1 for _ in Query(cls, query.predicates))
+        return query.apply_window(total)
+
+
+def refresh_all() -> dict:
+    """ Refresh all loaded classes, and return their generations by name
+    """
+    return {s_class: cls.refresh() for s_class, cls in list(_CLASSES.items())}
+
+
+def join_compactions():
+    """ Wait for the background compactions to finish
+    """
+    for thread in list(_COMPACTIONS.values()):
+        thread.join()
+
+
+atexit.register(join_compactions)
+
+
+def flush_all():
+    """ Write all pending group commits
+    """
+    with _FLUSH_CONDITION:
+        classes = list(_DIRTY)
+    for cls in classes:
+        cls.flush()
+
+
+def _flush_loop():
+    """ Group commit loop: wait for a change, let more changes come for
+    FLUSH_INTERVAL seconds or until FLUSH_COUNT are pending, then write
+    each changed class once
+    """
+    while True:
+        with _FLUSH_CONDITION:
+            _FLUSH_CONDITION.wait_for(lambda: _DIRTY)
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while _DIRTY and sum(_DIRTY.values()) < FLUSH_COUNT:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _FLUSH_CONDITION.wait(remaining)
+        flush_all()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+""" Binary snapshot module
+
+A snapshot file holds the same objects as a .db_<Class>.json file, laid
+out so that it can be opened without parsing every object:
+
+    MAGIC | header length (8 bytes, little endian) | header | records
+
+The header is a JSON document with the ids, the offset of each record
+and the values of the indexed attributes. Each record is the compact JSON
+of one object, parsed only when the object is first accessed.
+
+Convert from and to the JSON format with:
+
+    python3 -m models.snapshot to-binary .db_User.json .db_User.snap \
+        -i email
+    python3 -m models.snapshot to-json .db_User.snap .db_User.json
+
+Pass the indexed attributes of the class (User.INDEXES) with -i: the
+values of the others are read from every record when the snapshot is
+loaded.
+"""
+from collections.abc import MutableMapping
+from typing import BinaryIO, Callable, Iterable, Iterator, List
+import argparse
+import json
+import mmap
+import struct
+import sys
+
+
+MAGIC = b"BASESNAP1\n"
+_LENGTH = struct.Struct("<Q")
+
+
+def write_snapshot(f: BinaryIO, objs_json: dict,
+                   indexes: Iterable[str] = ()):
+    """ Write objects, given as JSON dictionaries by id, as a snapshot
+    """
+    indexes = list(indexes)
+    ids = []
+    offsets = [0]
+    indexed = {attr: [] for attr in indexes}
+    records = []
+    for obj_id, obj_json in objs_json.items():
+        record = json.dumps(obj_json, separators=(',', ':')).encode()
+        ids.append(obj_id)
+        records.append(record)
+        offsets.append(offsets[-1] + len(record))
+        for attr in indexes:
+            indexed[attr].append(obj_json.get(attr))
+    header = json.dumps({"ids": ids, "offsets": offsets,
+                         "indexed": indexed},
+                        separators=(',', ':')).encode()
+    f.write(MAGIC)
+    f.write(_LENGTH.pack(len(header)))
+    f.write(header)
+    for record in records:
+        f.write(record)
+
+
+class Pending():
+    """ Record of a snapshot not parsed yet
+    """
+    __slots__ = ('data', 'start', 'end')
+
+    def __init__(self, data: mmap.mmap, start: int, end: int):
+        """ Initialize a Pending record
+        """
+        self.data = data
+        self.start = start
+        self.end = end
+
+    def load_json(self) -> dict:
+        """ Parse the record
+        """
+        return json.loads(self.data[self.start:self.end])
+
+
+class LazyObjects(MutableMapping):
+    """ Objects of a snapshot by id, each built on first access
+
+    The snapshot file is memory-mapped, so opening it only reads the
+    header. Objects added or replaced afterwards are kept in memory.
+    """
+
+    def __init__(self, file_path: str, factory: Callable[[dict], object]):
+        """ Open a snapshot
+
+        factory builds an object from its JSON dictionary
+        """
+        self._factory = factory
+        with open(file_path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a snapshot".format(file_path))
+        start = len(MAGIC) + _LENGTH.size
+        header_length, = _LENGTH.unpack(self._data[len(MAGIC):start])
+        header = json.loads(self._data[start:start + header_length])
+        start += header_length
+        offsets = header["offsets"]
+        self._objs = {
+            obj_id: Pending(self._data, start + offsets[i],
+                            start + offsets[i + 1])
+            for i, obj_id in enumerate(header["ids"])}
+        self.indexed = {attr: dict(zip(header["ids"], values))
+                        for attr, values in header["indexed"].items()}
+
+    def __getitem__(self, obj_id: str) -> object:
+        """ Return an object, building it if needed
+        """
+        obj = self._objs[obj_id]
+        if type(obj) is Pending:
+            obj = self._factory(obj.load_json())
+            self._objs[obj_id] = obj
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: object):
+        """ Add or replace an object
+        """
+        self._objs[obj_id] = obj
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        del self._objs[obj_id]
+
+    def __contains__(self, obj_id: object) -> bool:
+        """ Check an id without building the object
+        """
+        return obj_id in self._objs
+
+    def __iter__(self) -> Iterator[str]:
+        """ Iterate over the ids
+        """
+        return iter(self._objs)
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self._objs)
+
+    def entries(self) -> List[tuple]:
+        """ (id, object or Pending record) pairs, without building any
+        object
+        """
+        return list(self._objs.items())
+
+
+def json_to_snapshot(json_path: str, snapshot_path: str,
+                     indexes: Iterable[str] = ()):
+    """ Convert a .db_<Class>.json file to a snapshot
+    """
+    with open(json_path, 'r') as f:
+        objs_json = json.load(f)
+    with open(snapshot_path, 'wb') as f:
+        write_snapshot(f, objs_json, indexes)
+
+
+def snapshot_to_json(snapshot_path: str, json_path: str):
+    """ Convert a snapshot to a .db_<Class>.json file
+    """
+    objs = LazyObjects(snapshot_path, dict)
+    with open(json_path, 'w') as f:
+        json.dump({obj_id: record.load_json()
+                   for obj_id, record in objs.entries()}, f)
+
+
+def main(argv: List[str]) -> int:
+    """ Convert between the JSON and the snapshot formats
+    """
+    parser = argparse.ArgumentParser(prog="python3 -m models.snapshot")
+    parser.add_argument("direction", choices=("to-binary", "to-json"))
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    parser.add_argument("-i", "--index", action="append", default=[],
+                        help="indexed attribute to store in the header "
+                             "(to-binary only, repeatable)")
+    args = parser.parse_args(argv)
+    if args.direction == "to-binary":
+        json_to_snapshot(args.src, args.dst, args.index)
+    else:
+        snapshot_to_json(args.src, args.dst)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+
+Storage engine of Base keeping objects in a SQLite database shared by all
+processes, instead of the per-process DATA dictionary. Each class has its
+own table: the object as JSON, and one indexed column per attribute of
+INDEXES (unique ones enforced by the database). The _generations table
+counts the changes of each class. The database runs in WAL mode, so
+readers never block the writer.
+"""
+from typing import Iterable, Iterator, List, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import warnings
+
+
+class SQLiteStorage():
+    """ SQLite storage engine
+    """
+
+    def __init__(self, file_path: str, timeout: float = 30):
+        """ Initialize a storage on a database file, created if needed
+        """
+        self.file_path = file_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._tables = set()
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+
+        A process forked after the connection was opened (a worker of a
+        pre-forking server) opens its own.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """ Close the connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _column(value: object) -> object:
+        """ Value of an indexed column
+        """
+        if value is None or type(value) in (str, int, float):
+            return value
+        return json.dumps(value)
+
+    def table(self, cls: type) -> str:
+        """ Create the table of a class and its indexes if needed, and
+        return its quoted name
+        """
+        name = '"{}"'.format(cls.__name__)
+        if cls in self._tables:
+            return name
+        with self._lock:
+            conn = self.connection()
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS _generations ("
+                             "name TEXT PRIMARY KEY, "
+                             "generation INTEGER NOT NULL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS {} ("
+                             "id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                             .format(name))
+                columns = {row[1] for row in conn.execute(
+                    "PRAGMA table_info({})".format(name))}
+                for attr, unique in cls.INDEXES.items():
+                    if attr not in columns:
+                        conn.execute("ALTER TABLE {} ADD COLUMN \"{}\""
+                                     .format(name, attr))
+                        conn.execute("UPDATE {0} SET \"{1}\" = json_extract("
+                                     "data, '$.{1}')".format(name, attr))
+                    self._create_index(conn, cls, attr, unique)
+            self._tables.add(cls)
+        return name
+
+    @staticmethod
+    def _create_index(conn: sqlite3.Connection, cls: type, attr: str,
+                      unique: bool):
+        """ Create the index of an attribute if needed
+
+        A unique index is created as a plain one, with a warning, if the
+        table already holds duplicate values.
+        """
+        sql = 'CREATE {0}INDEX IF NOT EXISTS "{1}_{2}" ON "{1}" ("{2}")'
+        try:
+            conn.execute(sql.format("UNIQUE " if unique else "",
+                                    cls.__name__, attr))
+        except sqlite3.IntegrityError:
+            warnings.warn("{} has duplicate {} values: they aren't enforced "
+                          "as unique".format(cls.__name__, attr))
+            conn.execute(sql.format("", cls.__name__, attr))
+
+    def _upsert(self, conn: sqlite3.Connection, obj: object):
+        """ Insert or update an object, without committing
+        """
+        cls = obj.__class__
+        attrs = list(cls.INDEXES)
+        columns = ''.join(', "{}"'.format(attr) for attr in attrs)
+        updates = ''.join(', "{0}" = excluded."{0}"'.format(attr)
+                          for attr in attrs)
+        values = [obj.id, json.dumps(obj.to_json(True))]
+        values += [self._column(getattr(obj, attr, None)) for attr in attrs]
+        conn.execute(
+            "INSERT INTO {} (id, data{}) VALUES ({}) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data{}"
+            .format(self.table(cls), columns, ', '.join('?' * len(values)),
+                    updates), values)
+
+    @staticmethod
+    def _bump_generation(conn: sqlite3.Connection, cls: type):
+        """ Count a change of a class, without committing
+        """
+        conn.execute("INSERT INTO _generations VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET "
+                     "generation = generation + 1", (cls.__name__,))
+
+    def generation(self, cls: type) -> int:
+        """ Number of changes of a class, by all processes
+        """
+        self.table(cls)
+        row = self.connection().execute(
+            "SELECT generation FROM _generations WHERE name = ?",
+            (cls.__name__,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def save(self, obj: object):
+        """ Insert or update an object
+
+        Raises ValueError if it would break a unique index
+        """
+        self.save_many([obj])
+
+    def save_many(self, objs: List[object]):
+        """ Insert or update objects in a single transaction
+
+        Raises ValueError, and saves none of them, if one would break a
+        unique index
+        """
+        classes = {obj.__class__ for obj in objs}
+        for cls in classes:
+            self.table(cls)
+        conn = self.connection()
+        obj = None
+        try:
+            with conn:
+                for obj in objs:
+                    self._upsert(conn, obj)
+                for cls in classes:
+                    self._bump_generation(conn, cls)
+        except sqlite3.IntegrityError as e:
+            raise self._unique_error(e, obj)
+
+    @staticmethod
+    def _unique_error(error: sqlite3.IntegrityError, obj: object
+                      ) -> ValueError:
+        """ ValueError of an object breaking a unique index, worded as
+        by the JSON storage
+        """
+        # "UNIQUE constraint failed: <table>.<column>"
+        attr = str(error).rsplit('.', 1)[-1]
+        return ValueError("{} {} already exists".format(
+            attr, getattr(obj, attr, None)))
+
+    def save_each(self, objs: List[object]) -> List[Optional[ValueError]]:
+        """ Insert or update objects in a single transaction, skipping
+        those which would break a unique index
+
+        Return, for each object, None if it was saved or its ValueError
+        """
+        classes = {obj.__class__ for obj in objs}
+        for cls in classes:
+            self.table(cls)
+        conn = self.connection()
+        errors = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for obj in objs:
+                conn.execute("SAVEPOINT item")
+                try:
+                    self._upsert(conn, obj)
+                    errors.append(None)
+                except sqlite3.IntegrityError as e:
+                    conn.execute("ROLLBACK TO item")
+                    errors.append(self._unique_error(e, obj))
+                conn.execute("RELEASE item")
+            for cls in classes:
+                self._bump_generation(conn, cls)
+        return errors
+
+    def remove(self, cls: type, obj_id: str) -> bool:
+        """ Delete an object by id, return False if there was none
+        """
+        return self.remove_many(cls, [obj_id])[0]
+
+    def remove_many(self, cls: type, obj_ids: List[str]) -> List[bool]:
+        """ Delete objects by id in a single transaction, and return for
+        each whether it existed
+        """
+        table = self.table(cls)
+        conn = self.connection()
+        removed = []
+        with conn:
+            for obj_id in obj_ids:
+                cursor = conn.execute("DELETE FROM {} WHERE id = ?".format(
+                    table), (obj_id,))
+                removed.append(cursor.rowcount > 0)
+            if any(removed):
+                self._bump_generation(conn, cls)
+        return removed
+
+    def _build(self, cls: type, data: str) -> object:
+        """ Build an object from its JSON
+        """
+        return cls(**json.loads(data))
+
+    def get(self, cls: type, obj_id: str) -> Optional[object]:
+        """ Return an object by id
+        """
+        row = self.connection().execute(
+            "SELECT data FROM {} WHERE id = ?".format(self.table(cls)),
+            (obj_id,)).fetchone()
+        return None if row is None else self._build(cls, row[0])
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of a class
+        """
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}".format(self.table(cls))).fetchone()[0]
+
+    def search(self, cls: type, attributes: dict) -> Iterator[object]:
+        """ Iterate over the objects whose attributes match, using the
+        indexed columns in SQL and checking the others on the objects
+        """
+        where = []
+        values = []
+        for k, v in attributes.items():
+            if k in cls.INDEXES:
+                where.append('"{}" IS ?'.format(k))
+                values.append(self._column(v))
+        query = "SELECT data FROM {}".format(self.table(cls))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY rowid"
+        for row in self.connection().execute(query, values):
+            obj = self._build(cls, row[0])
+            if all(getattr(obj, k) == v for k, v in attributes.items()):
+                yield obj
+
+    def _condition(self, cls: type, attr: str, op: str, value: object
+                   ) -> Optional[Tuple[str, list]]:
+        """ SQL condition and values of a query condition, or None if its
+        attribute has no column or SQL could decide it differently
+        """
+        if attr != 'id' and attr not in cls.INDEXES:
+            return None
+        column = '"{}"'.format(attr)
+        if op == 'eq' or op == 'in':
+            values = value if op == 'in' else (value,)
+            if not all(type(v) in (str, int, float) for v in values):
+                return None
+            if op == 'eq':
+                return "{} = ?".format(column), list(values)
+            return "{} IN ({})".format(column, ', '.join('?' * len(values))
+                                       ), list(values)
+        if op == 'prefix':
+            if type(value) is not str or value[-1:] == chr(0x10ffff):
+                return None
+            if not value:
+                return "typeof({}) = 'text'".format(column), []
+            # Text compares as UTF-8 bytes, in the order of Python strings
+            return "{0} >= ? AND {0} < ?".format(column), [
+                value, value[:-1] + chr(ord(value[-1]) + 1)]
+        if type(value) is str:
+            kind = "= 'text'"
+        elif type(value) in (int, float):
+            kind = "IN ('integer', 'real')"
+        else:
+            return None
+        comparison = {'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}[op]
+        return "typeof({0}) {1} AND {0} {2} ?".format(
+            column, kind, comparison), [value]
+
+    def _where(self, cls: type, predicates: Iterable[tuple]
+               ) -> Tuple[str, list, bool]:
+        """ WHERE clause and values of the conditions of a query decided in
+        SQL, and whether they are all of them
+        """
+        conditions = []
+        values = []
+        complete = True
+        for attr, op, value in predicates:
+            condition = self._condition(cls, attr, op, value)
+            if condition is None:
+                complete = False
+                continue
+            conditions.append(condition[0])
+            values += condition[1]
+        if not conditions:
+            return "", values, complete
+        return " WHERE " + " AND ".join(conditions), values, complete
+
+    def can_order(self, cls: type, query: object) -> bool:
+        """ Whether SQL can order the objects of a query
+        """
+        return query.order_attr in (None, 'id') or \
+            query.order_attr in cls.INDEXES
+
+    def query(self, cls: type, query: object
+              ) -> Tuple[Iterator[object], bool]:
+        """ Objects of a query (see models.query), and whether SQL applied
+        all of it: else they still have to be checked against the other
+        conditions, and ordered if can_order is False, before applying
+        the offset and the limit
+        """
+        where, values, complete = self._where(cls, query.predicates)
+        order = "rowid"
+        if query.order_attr is not None and self.can_order(cls, query):
+            # Objects without the attribute come last
+            order = '"{0}" IS NULL, "{0}" {1}, rowid'.format(
+                query.order_attr, "DESC" if query.descending else "ASC")
+        done = complete and self.can_order(cls, query)
+        sql = "SELECT data FROM {}{} ORDER BY {}".format(
+            self.table(cls), where, order)
+        if done:
+            sql += " LIMIT ? OFFSET ?"
+            values += [-1 if query.max_count is None else query.max_count,
+                       query.skip]
+        rows = self.connection().execute(sql, values)
+        return (self._build(cls, data) for data, in rows), done
+
+    def count_query(self, cls: type, query: object) -> Optional[int]:
+        """ Number of objects matching the conditions of a query, or None
+        if SQL can't decide all of them
+        """
+        where, values, complete = self._where(cls, query.predicates)
+        if not complete:
+            return None
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}{}".format(self.table(cls), where),
+            values).fetchone()[0]
+
+    def sorted_ids(self, cls: type) -> List[str]:
+        """ Ids of all objects of a class in ascending order
+        """
+        return [row[0] for row in self.connection().execute(
+            "SELECT id FROM {} ORDER BY id".format(self.table(cls)))]
+
+    def page(self, cls: type, limit: int, cursor: str = None
+             ) -> Tuple[List[object], Optional[str]]:
+        """ Return up to limit objects in id order, starting after the id
+        cursor, and the cursor of the next page (None on the last page)
+        """
+        rows = self.connection().execute(
+            "SELECT id, data FROM {} WHERE id > ? ORDER BY id LIMIT ?"
+            .format(self.table(cls)),
+            ('' if cursor is None else cursor, limit + 1)).fetchall()
+        objs = [self._build(cls, data) for _, data in rows[:limit]]
+        return objs, (rows[limit - 1][0] if len(rows) > limit else None)
+
+    def iter_all(self, cls: type, batch_size: int = 500) -> Iterator[object]:
+        """ Iterate over all objects of a class in id order
+        """
+        cursor = None
+        while True:
+            objs, cursor = self.page(cls, batch_size, cursor)
+            yield from objs
+            if cursor is None:
+                return
+
+    def import_objects(self, cls: type, objs_json: dict
+                       ) -> List[Tuple[str, ValueError]]:
+        """ Insert objects given as JSON dictionaries by id, if the table
+        of the class is empty
+
+        Objects breaking a unique index (duplicates of a store written
+        before the index existed) are skipped with a warning. Return the
+        id and the ValueError of each of them.
+        """
+        if self.count(cls) > 0:
+            return []
+        objs = [cls(**obj_json) for obj_json in objs_json.values()]
+        skipped = [(obj.id, error)
+                   for obj, error in zip(objs, self.save_each(objs))
+                   if error is not None]
+        if skipped:
+            warnings.warn("{} {} objects not imported: {}".format(
+                len(skipped), cls.__name__, "; ".join(
+                    "{} ({})".format(obj_id, error)
+                    for obj_id, error in skipped)))
+        return skipped
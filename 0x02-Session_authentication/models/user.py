@@ -7,6 +7,9 @@ from models.base import Base
 class User(Base):
     """ User class
     """
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+
+    INDEXES = {'email': True}
 
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Tests of the session auths on their session stores
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_exp_auth import SessionExpAuth
+from api.v1.auth.session_store import MemorySessionStore
+from datetime import datetime
+from unittest import mock
+import os
+import unittest
+
+
+class TestSessionAuth(unittest.TestCase):
+    """ Tests of SessionAuth and of its user_id_by_session_id
+    """
+
+    def test_create_session(self):
+        """ A session maps to its user until destroyed
+        """
+        auth = SessionAuth(MemorySessionStore())
+        session_id = auth.create_session("u1")
+        self.assertEqual(auth.user_id_for_session_id(session_id), "u1")
+        self.assertIsNone(auth.create_session(None))
+        self.assertIsNone(auth.user_id_for_session_id("unknown"))
+
+    def test_user_id_by_session_id(self):
+        """ The former dictionary reads and writes the store
+        """
+        auth = SessionAuth(MemorySessionStore())
+        session_id = auth.create_session("u1")
+        self.assertEqual(dict(auth.user_id_by_session_id),
+                         {session_id: "u1"})
+        auth.user_id_by_session_id["s2"] = "u2"
+        self.assertEqual(auth.user_id_for_session_id("s2"), "u2")
+        self.assertEqual(auth.user_id_by_session_id.get("s2"), "u2")
+        del auth.user_id_by_session_id["s2"]
+        self.assertNotIn("s2", auth.user_id_by_session_id)
+        with self.assertRaises(KeyError):
+            del auth.user_id_by_session_id["s2"]
+        self.assertEqual(len(auth.user_id_by_session_id), 1)
+
+    def test_exp_user_id_by_session_id(self):
+        """ SessionExpAuth keeps the user ID and creation time
+        """
+        auth = SessionExpAuth(MemorySessionStore())
+        session_id = auth.create_session("u1")
+        entry = auth.user_id_by_session_id[session_id]
+        self.assertEqual(entry['user_id'], "u1")
+        self.assertIsInstance(entry['created_at'], datetime)
+        auth.user_id_by_session_id["s2"] = {'user_id': "u2",
+                                            'created_at': datetime.now()}
+        self.assertEqual(auth.user_id_for_session_id("s2"), "u2")
+
+    def test_invalid_environment(self):
+        """ Invalid sweep settings fall back to their defaults
+        """
+        env = {'SESSION_DURATION': "60", 'SESSION_SWEEP_BATCH': "many",
+               'SESSION_SWEEP_INTERVAL': "often"}
+        with mock.patch.dict(os.environ, env):
+            auth = SessionExpAuth(MemorySessionStore())
+        self.assertEqual(auth.sweep_batch, 100)
+        self.assertIsNone(auth.sweeper)
+
+
+if __name__ == "__main__":
+    unittest.main()
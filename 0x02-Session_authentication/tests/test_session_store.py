@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+""" Tests of the session stores, on temporary files and sockets
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from api.v1.auth.session_store import (
+    MemorySessionStore, SessionStoreError, SessionStoreServer,
+    SocketSessionStore, SQLiteSessionStore, handle_request)
+from datetime import datetime, timedelta
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+
+class StoreTests():
+    """ Tests shared by all the stores, on self.store holding at most
+    three sessions
+    """
+
+    def test_set_get_delete(self):
+        """ A session is found until deleted
+        """
+        now = datetime.now()
+        self.store.set("s1", "u1", now)
+        session = self.store.get("s1")
+        self.assertEqual(session['user_id'], "u1")
+        self.assertEqual(session['created_at'].timestamp(),
+                         now.timestamp())
+        self.assertIsNone(session['expires_at'])
+        self.assertEqual(self.store.session_ids(), ["s1"])
+        self.assertTrue(self.store.delete("s1"))
+        self.assertFalse(self.store.delete("s1"))
+        self.assertIsNone(self.store.get("s1"))
+
+    def test_expiry(self):
+        """ Expired sessions are never returned and are swept
+        """
+        now = datetime.now()
+        self.store.set("old", "u1", now - timedelta(hours=2),
+                       now - timedelta(hours=1))
+        self.store.set("new", "u2", now, now + timedelta(hours=1))
+        self.assertIsNone(self.store.get("old"))
+        self.assertEqual(self.store.get("new")['user_id'], "u2")
+        self.store.sweep()
+        self.assertEqual(self.store.session_ids(), ["new"])
+        self.assertEqual(self.store.sweep(now + timedelta(hours=2)), 1)
+        self.assertEqual(self.store.stats()['sessions'], 0)
+
+    def test_sweep_limit(self):
+        """ A sweep deletes at most limit sessions
+        """
+        past = datetime.now() - timedelta(hours=1)
+        for i in range(3):
+            self.store.set("s{}".format(i), "u", past, past)
+        self.assertEqual(self.store.sweep(limit=2), 2)
+        self.assertEqual(self.store.sweep(limit=2), 1)
+
+    def test_max_sessions(self):
+        """ The oldest sessions past the maximum are evicted
+        """
+        now = datetime.now()
+        for i in range(5):
+            self.store.set("s{}".format(i), "u", now + timedelta(seconds=i))
+        self.assertEqual(sorted(self.store.session_ids()),
+                         ["s2", "s3", "s4"])
+        stats = self.store.stats()
+        self.assertEqual((stats['sessions'], stats['evicted']), (3, 2))
+
+
+class TestMemorySessionStore(StoreTests, unittest.TestCase):
+    """ Tests of MemorySessionStore
+    """
+
+    def setUp(self):
+        """ Create a store
+        """
+        self.store = MemorySessionStore(max_sessions=3)
+
+
+class TestSQLiteSessionStore(StoreTests, unittest.TestCase):
+    """ Tests of SQLiteSessionStore
+    """
+
+    def setUp(self):
+        """ Create a store on a temporary database
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, "sessions.sqlite3")
+        self.store = SQLiteSessionStore(self.file_path, max_sessions=3)
+
+    def tearDown(self):
+        """ Close the store and delete its database
+        """
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def test_shared(self):
+        """ A second store on the same file sees the sessions
+        """
+        self.store.set("s1", "u1", datetime.now())
+        other = SQLiteSessionStore(self.file_path)
+        self.assertEqual(other.get("s1")['user_id'], "u1")
+        other.close()
+
+
+class TestSocketSessionStore(StoreTests, unittest.TestCase):
+    """ Tests of SocketSessionStore and of the server
+    """
+
+    def setUp(self):
+        """ Serve a memory store on a temporary socket
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp_dir.name, "sessions.sock")
+        self.server = SessionStoreServer(self.address,
+                                         MemorySessionStore(max_sessions=3))
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.store = SocketSessionStore(self.address)
+
+    def tearDown(self):
+        """ Stop the server and delete its socket
+        """
+        self.store.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def request(self, line: bytes) -> dict:
+        """ Send a raw request line to the server, return its response
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.address)
+            sock.sendall(line)
+            with sock.makefile('rb') as f:
+                return json.loads(f.readline())
+
+    def test_protocol(self):
+        """ Requests and responses are JSON lines, errors included
+        """
+        response = self.request(json.dumps({
+            'op': 'set', 'session_id': "s1", 'user_id': "u1",
+            'created_at': 0, 'expires_at': None}).encode() + b"\n")
+        self.assertEqual(response, {'ok': True})
+        response = self.request(b'{"op": "get", "session_id": "s1"}\n')
+        self.assertEqual(response['session']['user_id'], "u1")
+        self.assertIn('error', self.request(b'{"op": "nope"}\n'))
+        self.assertIn('error', self.request(b'not json\n'))
+        self.assertIn('error', self.request(b'{"op": "set"}\n'))
+
+    def test_error_response(self):
+        """ An error of the server is raised by the client
+        """
+        with self.assertRaises(SessionStoreError):
+            self.store._call({'op': 'nope'}, 'session')
+
+    def test_reconnect(self):
+        """ The client connects again after the server dropped it
+        """
+        self.store.set("s1", "u1", datetime.now())
+        self.store._local.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.store.get("s1")['user_id'], "u1")
+
+
+class TestStandIn(unittest.TestCase):
+    """ SocketSessionStore against a stand-in server answering errors
+    """
+
+    def setUp(self):
+        """ Listen on a temporary socket
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        address = os.path.join(self.tmp_dir.name, "stand-in.sock")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(address)
+        self.listener.listen(1)
+        threading.Thread(target=self.serve, daemon=True).start()
+        self.store = SocketSessionStore(address)
+
+    def tearDown(self):
+        """ Close the client and the stand-in
+        """
+        self.store.close()
+        self.listener.close()
+        self.tmp_dir.cleanup()
+
+    def serve(self):
+        """ Answer every request with an error
+        """
+        conn, _ = self.listener.accept()
+        with conn, conn.makefile('rwb') as f:
+            for _ in f:
+                f.write(b'{"error": "store unavailable"}\n')
+                f.flush()
+
+    def test_errors(self):
+        """ Every operation raises SessionStoreError
+        """
+        calls = (lambda: self.store.get("s1"),
+                 lambda: self.store.delete("s1"),
+                 lambda: self.store.sweep(),
+                 lambda: self.store.set("s1", "u1", datetime.now()))
+        for call in calls:
+            with self.assertRaises(SessionStoreError) as cm:
+                call()
+            self.assertEqual(str(cm.exception), "store unavailable")
+
+
+class TestHandleRequest(unittest.TestCase):
+    """ Tests of the requests of the protocol on a store
+    """
+
+    def test_ops(self):
+        """ Each op answers with its key
+        """
+        store = MemorySessionStore()
+        self.assertEqual(handle_request(store, {
+            'op': 'set', 'session_id': "s1", 'user_id': "u1",
+            'created_at': 0}), {'ok': True})
+        self.assertEqual(handle_request(store, {'op': 'ids'}),
+                         {'ids': ["s1"]})
+        self.assertEqual(handle_request(store, {'op': 'sweep'}),
+                         {'removed': 0})
+        self.assertEqual(handle_request(
+            store, {'op': 'delete', 'session_id': "s1"}), {'deleted': True})
+        self.assertEqual(handle_request(
+            store, {'op': 'get', 'session_id': "s1"}), {'session': None})
+        self.assertEqual(handle_request(store, {'op': 'stats'})['stats'][
+            'sessions'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
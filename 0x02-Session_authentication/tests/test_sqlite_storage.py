@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+""" Tests of the SQLite storage engine, on a temporary database file
+
+Run from the project directory with:
+
+    python3 -m unittest discover tests
+"""
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+import os
+import sqlite3
+import tempfile
+import unittest
+import warnings
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """ Tests of SQLiteStorage
+    """
+
+    def setUp(self):
+        """ Open a storage on a new database file
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, "db.sqlite3")
+        self.storage = SQLiteStorage(self.file_path)
+
+    def tearDown(self):
+        """ Close the storage and delete its files
+        """
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def test_save_get_remove(self):
+        """ An object saved is found by id until removed
+        """
+        user = User(email="bob@example.com", first_name="Bob")
+        self.storage.save(user)
+        found = self.storage.get(User, user.id)
+        self.assertEqual(found.to_json(True), user.to_json(True))
+        self.assertEqual(self.storage.count(User), 1)
+        self.assertTrue(self.storage.remove(User, user.id))
+        self.assertFalse(self.storage.remove(User, user.id))
+        self.assertIsNone(self.storage.get(User, user.id))
+
+    def test_shared_between_connections(self):
+        """ A second storage on the same file sees the changes
+        """
+        user = User(email="bob@example.com")
+        self.storage.save(user)
+        other = SQLiteStorage(self.file_path)
+        self.assertEqual(other.get(User, user.id).email, "bob@example.com")
+        self.assertEqual(other.generation(User),
+                         self.storage.generation(User))
+        other.close()
+
+    def test_search(self):
+        """ Search uses the indexed columns and checks the others
+        """
+        bob = User(email="bob@example.com", first_name="Bob")
+        ann = User(email="ann@example.com", first_name="Ann")
+        self.storage.save_many([bob, ann])
+        self.assertEqual(
+            [u.id for u in self.storage.search(
+                User, {'email': "ann@example.com"})], [ann.id])
+        self.assertEqual(
+            [u.id for u in self.storage.search(User, {'first_name': "Bob"})],
+            [bob.id])
+        self.assertEqual(len(list(self.storage.search(User, {}))), 2)
+
+    def test_unique_index(self):
+        """ A duplicate value of a unique index is rejected
+        """
+        self.storage.save(User(email="bob@example.com"))
+        with self.assertRaises(ValueError) as cm:
+            self.storage.save(User(email="bob@example.com"))
+        self.assertEqual(str(cm.exception),
+                         "email bob@example.com already exists")
+        errors = self.storage.save_each([User(email="bob@example.com"),
+                                         User(email="ann@example.com")])
+        self.assertIsInstance(errors[0], ValueError)
+        self.assertIsNone(errors[1])
+        self.assertEqual(self.storage.count(User), 2)
+
+    def test_page(self):
+        """ Pages follow the id order
+        """
+        users = [User(email="{}@example.com".format(i)) for i in range(5)]
+        self.storage.save_many(users)
+        ids = sorted(user.id for user in users)
+        objs, cursor = self.storage.page(User, 3)
+        self.assertEqual([u.id for u in objs], ids[:3])
+        objs, cursor = self.storage.page(User, 3, cursor)
+        self.assertEqual([u.id for u in objs], ids[3:])
+        self.assertIsNone(cursor)
+
+    def test_import_objects(self):
+        """ JSON objects are imported into an empty table only
+        """
+        bob = User(email="bob@example.com")
+        self.assertEqual(self.storage.import_objects(
+            User, {bob.id: bob.to_json(True)}), [])
+        self.assertEqual(self.storage.count(User), 1)
+        self.storage.import_objects(
+            User, {'x': User(id='x', email="x@example.com").to_json(True)})
+        self.assertIsNone(self.storage.get(User, 'x'))
+
+    def test_import_duplicates(self):
+        """ Duplicates of a unique index are skipped with a warning
+        """
+        first = User(email="bob@example.com")
+        second = User(email="bob@example.com")
+        objs_json = {user.id: user.to_json(True) for user in (first, second)}
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            skipped = self.storage.import_objects(User, objs_json)
+        self.assertEqual([obj_id for obj_id, _ in skipped], [second.id])
+        self.assertEqual(len(caught), 1)
+        self.assertIsNotNone(self.storage.get(User, first.id))
+
+    def test_unique_index_on_duplicates(self):
+        """ A table already holding duplicates keeps a plain index
+        """
+        conn = sqlite3.connect(self.file_path)
+        with conn:
+            conn.execute('CREATE TABLE "User" (id TEXT PRIMARY KEY, '
+                         'data TEXT NOT NULL)')
+            for obj_id in ('a', 'b'):
+                conn.execute('INSERT INTO "User" VALUES (?, ?)', (
+                    obj_id, '{"id": "%s", "email": "bob@example.com"}'
+                    % obj_id))
+        conn.close()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertEqual(self.storage.count(User), 2)
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(len(list(self.storage.search(
+            User, {'email': "bob@example.com"}))), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()